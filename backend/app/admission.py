@@ -0,0 +1,216 @@
+"""Peak-memory estimates for analyses and a budget that admits them.
+
+Several large drawings uploaded together would otherwise all be parsed at
+once and exhaust RAM. Before an analysis starts, ``estimate_analysis`` runs a
+cheap pre-scan of the file (a regex over the raw bytes, no parsing) in a
+worker process and predicts the worker's peak memory from the file size and
+record counts.
+``MemoryBudget`` then only lets analyses run while the sum of their
+estimates fits in the configured budget; the rest wait in FIFO order.
+"""
+import asyncio
+import os
+import re
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import NamedTuple, Optional, Tuple
+
+from .storage import open_upload, original_path, upload_size
+from .tagreader import SUPPORTED_TYPES
+
+# Peak worker memory in MB above its idle baseline, modelled as
+# ``base + per_record * records + per_mb * file_mb``. ``records`` is the
+# number of ENTITIES records for the fast and streaming readers and the
+# number of records in the whole file for ezdxf, which loads all of them.
+# Fitted by benchmarks/bench_memory.py and rounded up by 10-20%; the size
+# term dominates, record counts only matter for files of many tiny records.
+# The streaming figure assumes the whole preview is kept, so it's an upper
+# bound when the preview is capped.
+MEMORY_MODELS = {
+    "fast": (12.0, 0.0, 13.0),
+    "streaming": (8.0, 0.0, 1.5),
+    "full": (8.0, 0.0001, 17.0),
+    "recover": (8.0, 0.0001, 17.0),
+}
+
+# Rough record size used when a file can't be pre-scanned (binary DXF)
+BYTES_PER_RECORD = 150
+
+_BINARY_SENTINEL = b"AutoCAD Binary DXF\r\n\x1a\x00"
+# A record's "0" code line and its type; the lookahead leaves the line end
+# for the next match
+_RECORD_RE = re.compile(rb"\n[ \t]*0\r?\n([A-Z_][A-Z0-9_]*)(?=\r?\n)")
+_ENTITIES_RE = re.compile(rb"\n[ \t]*0\r?\nSECTION\r?\n[ \t]*2\r?\nENTITIES(?=\r?\n)")
+_ENDSEC_RE = re.compile(rb"\n[ \t]*0\r?\nENDSEC(?=\r?\n)")
+_BLOCK_SIZE = 8 * 1024 * 1024
+# Longer than any single record's "0"/type lines
+_OVERLAP = 1024
+
+
+class FileProfile(NamedTuple):
+    size: int           # uncompressed bytes
+    records: int        # records ("0" group codes) in the whole file
+    entities: int       # records in the ENTITIES section
+    supported: bool     # every entity type is handled by the tag-level reader
+
+
+def prescan(filepath: str) -> FileProfile:
+    """Count the records of a file without parsing it.
+
+    The file is searched a block at a time with regular expressions only,
+    which takes a small fraction of the time of even the tag-level reader.
+    """
+    size = upload_size(filepath)
+    records = entities = 0
+    types = set()
+    in_entities = False
+
+    with open_upload(filepath) as f:
+        data = f.read(_BLOCK_SIZE)
+        if data.startswith(_BINARY_SENTINEL):
+            records = entities = size // BYTES_PER_RECORD
+            return FileProfile(size, records, entities, False)
+
+        data = b"\n" + data
+        while data:
+            block = f.read(_BLOCK_SIZE)
+            # Only count up to a record start near the end of the block, so
+            # every record is counted whole in exactly one block
+            cut = len(data)
+            if block:
+                boundary = _RECORD_RE.search(data, max(0, len(data) - _OVERLAP))
+                # No record starts near the end: carry the block over whole
+                cut = boundary.start() if boundary is not None else 0
+            # Search up to and including the "\n" at the cut for the lookaheads
+            stop = cut + 1
+
+            records += len(_RECORD_RE.findall(data, 0, stop))
+            pos = 0
+            while pos < cut:
+                if in_entities:
+                    end = _ENDSEC_RE.search(data, pos, stop)
+                    found = _RECORD_RE.findall(data, pos, end.start() + 1 if end else stop)
+                    entities += len(found)
+                    types.update(found)
+                    if end is None:
+                        break
+                    in_entities = False
+                    pos = end.end()
+                else:
+                    start = _ENTITIES_RE.search(data, pos, stop)
+                    if start is None:
+                        break
+                    in_entities = True
+                    pos = start.end()
+
+            if not block:
+                break
+            data = data[cut:] + block
+
+    return FileProfile(size, records, entities, types <= SUPPORTED_TYPES)
+
+
+def estimate_mb(profile: FileProfile, mode: str) -> float:
+    """Estimated peak memory of analyzing a file in ``mode``"""
+    base, per_record, per_mb = MEMORY_MODELS[mode]
+    records = profile.entities if mode in ("fast", "streaming") else profile.records
+    return base + per_record * records + per_mb * profile.size / (1024 * 1024)
+
+
+def estimate_analysis(filepath: str, fast_reader: bool = True, streaming_threshold: int = 0,
+                      loader: Optional[str] = None,
+                      binary_copy: bool = False) -> Tuple[str, float]:
+    """Predict the mode ``analyze_file`` will use and its peak memory in MB.
+
+    Takes the settings of ``analyze_file`` that choose the mode.
+    """
+    from .dwg_service import binary_copy_path
+
+    if original_path(filepath).lower().endswith(".dwg"):
+        return "full", MEMORY_MODELS["full"][0]
+
+    profile = prescan(filepath)
+    large = bool(streaming_threshold) and profile.size > streaming_threshold
+
+    if binary_copy and os.path.exists(binary_copy_path(filepath)):
+        mode = "full"
+    elif loader == "recover":
+        mode = "recover"
+    elif fast_reader and profile.supported:
+        mode = "fast"
+    elif large:
+        mode = "streaming"
+    else:
+        mode = "full"
+    return mode, round(estimate_mb(profile, mode), 1)
+
+
+class MemoryBudget:
+    """Admits jobs while the sum of their memory estimates fits in a budget.
+
+    Jobs are admitted in arrival order, so a large job isn't starved by a
+    stream of small ones. A job whose estimate alone exceeds the budget runs
+    once nothing else is running. ``budget_mb=0`` admits everything.
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None):
+        self.budget_mb = budget_mb or None
+        self.in_use_mb = 0.0
+        self.running = 0
+        self._waiters = deque()
+
+    def _fits(self, mb: float) -> bool:
+        return self.running == 0 or self.in_use_mb + mb <= self.budget_mb
+
+    def _admit(self, mb: float):
+        self.in_use_mb += mb
+        self.running += 1
+
+    def _release(self, mb: float):
+        self.running -= 1
+        self.in_use_mb = self.in_use_mb - mb if self.running else 0.0
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._fits(self._waiters[0][0]):
+            mb, future = self._waiters.popleft()
+            if future.cancelled():
+                continue  # its caller is about to see CancelledError
+            self._admit(mb)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def reserve(self, mb: float):
+        """Wait until ``mb`` fits in the budget and hold it for the block"""
+        if self.budget_mb is None:
+            yield
+            return
+
+        if self._waiters or not self._fits(mb):
+            entry = (mb, asyncio.get_running_loop().create_future())
+            self._waiters.append(entry)
+            try:
+                await entry[1]
+            except asyncio.CancelledError:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    self._wake()
+                elif not entry[1].cancelled():
+                    # Admitted just as the caller went away
+                    self._release(mb)
+                raise
+        else:
+            self._admit(mb)
+
+        try:
+            yield
+        finally:
+            self._release(mb)
+
+    def stats(self) -> dict:
+        return {
+            "budget_mb": self.budget_mb,
+            "in_use_mb": round(self.in_use_mb, 1),
+            "running": self.running,
+            "queued": len(self._waiters),
+        }
@@ -0,0 +1,193 @@
+"""Two-level cache of analysis results.
+
+``AnalysisCache`` keeps the results the layers, measurements and preview
+endpoints share, keyed by drawing content and extractor version: in memory
+in a bounded ``TTLCache`` (LRU with expiry), then on disk as memory-mapped
+geometry sidecars (``sidecar.py``) that survive restarts, bounded by size.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from .sidecar import has_sidecar, load_sidecar, remove_sidecar, save_sidecar
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+
+    The least recently used entry is evicted once ``maxsize`` is reached.
+    A ``ttl`` of 0 disables expiry.
+    """
+
+    def __init__(self, maxsize: int = 8, ttl: float = 600.0):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.monotonic() - stored_at > self.ttl
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, stored_at = item
+            if self._expired(stored_at):
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not self._expired(item[1])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class AnalysisCache:
+    """Analysis results by drawing content: in memory, then on disk.
+
+    Keys are ``<sha256 of the drawing>-<version>``, where ``version`` names
+    the extractors and the settings that shape their output. A result is
+    found again for the same content whichever upload it came with and after
+    a restart, while a deploy that changes the extraction (and so the
+    version) no longer sees the old entries.
+
+    Memory is a ``TTLCache``. The disk level keeps results as sidecars in
+    ``directory``, up to ``max_disk_bytes``; the least recently used ones
+    are removed beyond that, starting with those of other versions, which
+    nothing reads any more. Without a directory or size only memory is used.
+    """
+
+    def __init__(self, version: str, maxsize: int = 8, ttl: float = 600.0,
+                 directory: Optional[str] = None, max_disk_bytes: int = 0):
+        self.version = version
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.directory = directory if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, sha256: str) -> str:
+        return f"{sha256}-{self.version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Look a result up in memory only (doesn't block)"""
+        result = self.memory.get(key)
+        if result is not None:
+            with self._lock:
+                self.memory_hits += 1
+        return result
+
+    def load(self, key: str) -> Optional[dict]:
+        """Read a result from disk into memory; blocks on disk I/O.
+
+        Called after ``get`` missed, so a None here counts as a miss.
+        """
+        result = None
+        if self.directory is not None:
+            path = self._path(key)
+            result = load_sidecar(path)
+            if result is not None:
+                try:
+                    # Recently used, for the eviction
+                    os.utime(path)
+                except OSError:
+                    pass
+                self.memory.set(key, result)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+        return result
+
+    def set(self, key: str, result: dict, persist: bool = True) -> None:
+        """Store a result in memory and, with ``persist``, on disk (blocks)"""
+        self.memory.set(key, result)
+        if persist and self.directory is not None and save_sidecar(self._path(key), result):
+            self._evict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.memory or (self.directory is not None and has_sidecar(self._path(key)))
+
+    def _evict(self):
+        """Remove the least recently used entries beyond ``max_disk_bytes``"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                # Skip sidecars still being written
+                if not entry.is_dir() or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                current = entry.name.partition("-")[2] == self.version
+                entries.append((current, mtime, size, entry.path))
+            total = sum(size for _, _, size, _ in entries)
+            for _, _, size, path in sorted(entries):
+                if total <= self.max_disk_bytes:
+                    break
+                remove_sidecar(path)
+                total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "version": self.version,
+                "memory_size": len(self.memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,532 @@
+"""DWG/DXF parsing and extraction"""
+from typing import Optional
+
+from fastapi import HTTPException
+
+from .models import LayerInfo, BoundingBox, Measurements
+
+# Bump whenever a change to the extraction changes its results, so that
+# cached analyses of the previous code are no longer used
+EXTRACTOR_VERSION = "2"
+
+
+def extractor_version(*settings) -> str:
+    """Version of the analysis results: the extractors, ezdxf and the settings
+    that shape the results"""
+    import hashlib
+    import ezdxf
+
+    digest = hashlib.sha256(repr(settings).encode()).hexdigest()[:8]
+    return f"{EXTRACTOR_VERSION}.{ezdxf.__version__}.{digest}"
+
+
+def convert_dwg_to_dxf(dwg_path: str) -> str:
+    """Convert DWG to DXF using ODA File Converter"""
+    import subprocess
+    import os
+
+    dxf_path = dwg_path.replace('.dwg', '.dxf')
+    # Check multiple possible locations for ODA File Converter
+    oda_path = os.environ.get('ODA_CONVERTER_PATH', '/tmp/oda/ODAFileConverter')
+
+    # Fallback locations
+    if not os.path.exists(oda_path):
+        for fallback in ['/tmp/oda/ODAFileConverter', '/opt/oda/ODAFileConverter', './ODAFileConverter']:
+            if os.path.exists(fallback):
+                oda_path = fallback
+                break
+
+    # Check if ODA converter exists
+    if not os.path.exists(oda_path):
+        # Try to find it in PATH
+        result = subprocess.run(['which', 'ODAFileConverter'], capture_output=True, text=True)
+        if result.returncode == 0:
+            oda_path = result.stdout.strip()
+        else:
+            raise Exception("ODA File Converter not found. Please install it or convert DWG to DXF manually.")
+
+    # ODAFileConverter syntax: "InputFolder" "OutputFolder" "ACAD2018" "ACAD2018" "DXF" "1" "1"
+    # Version "ACAD2018" = AutoCAD 2018 format
+    # Output type "DXF" = DXF format
+    # "1" "1" = recursive, audit
+    input_dir = os.path.dirname(dwg_path) or '.'
+    output_dir = input_dir
+    filename = os.path.basename(dwg_path)
+
+    cmd = [
+        oda_path,
+        input_dir,
+        output_dir,
+        "ACAD2018",  # Input version (auto-detect)
+        "ACAD2018",  # Output version
+        "DXF",       # Output format
+        "0",         # Recursive (0=no)
+        "1"          # Audit (1=yes)
+    ]
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            print(f"ODA conversion stderr: {result.stderr}")
+
+        # Check if output file was created
+        expected_dxf = os.path.splitext(dwg_path)[0] + '.dxf'
+        if os.path.exists(expected_dxf):
+            return expected_dxf
+        else:
+            raise Exception(f"Conversion failed. Output file not found: {expected_dxf}")
+    except subprocess.TimeoutExpired:
+        raise Exception("DWG conversion timed out")
+    except Exception as e:
+        raise Exception(f"DWG conversion failed: {e}")
+
+
+def parse_dxf_file(filepath: str, loader: Optional[str] = None):
+    """Parse a DXF/DWG file and return ``(doc, loader, fixes)``.
+
+    The strict ``ezdxf.readfile`` loader is tried first; if it rejects the
+    file as malformed, ``ezdxf.recover.readfile`` (several times slower)
+    rebuilds the document and the auditor repairs it. ``loader`` is the
+    loader that succeeded and ``fixes`` lists the auditor's repairs. Pass the
+    loader from an earlier parse to skip the strict attempt. ``doc`` is None
+    if the file can't be parsed.
+    """
+    import ezdxf
+    from ezdxf import recover
+    import os
+    from .storage import open_upload, original_path
+
+    file_ext = os.path.splitext(original_path(filepath))[1].lower()
+
+    try:
+        if file_ext == '.dwg':
+            # DWG is a proprietary binary format that requires external conversion
+            # ezdxf can only read DXF (text-based) format natively
+            raise HTTPException(
+                status_code=400,
+                detail="DWG files require conversion to DXF. Please convert your file using:\n"
+                       "1. AutoCAD: SAVEAS → DXF format\n"
+                       "2. FreeCAD: File → Export → DXF (free)\n"
+                       "3. Online: anyconv.com, zamzar.com\n"
+                       "4. Or use the sample.dxf file from our GitHub repo"
+            )
+
+        if loader != "recover":
+            try:
+                return read_dxf(filepath), "strict", []
+            except (ezdxf.DXFError, UnicodeDecodeError) as e:
+                print(f"Strict parse of {filepath} failed, trying recover mode: {e}")
+
+        with open_upload(filepath) as stream:
+            doc, auditor = recover.read(stream)
+        fixes = [entry.message for entry in auditor.fixes]
+        if auditor.has_errors:
+            print(f"Recovered {filepath} with {len(auditor.errors)} unfixed errors")
+        return doc, "recover", fixes
+    except MemoryError:
+        raise
+    except Exception as e:
+        print(f"Error parsing file {filepath}: {e}")
+        return None, None, []
+
+
+def read_dxf(filepath: str):
+    """``ezdxf.readfile`` that also reads compressed uploads, as a stream"""
+    import io
+    import ezdxf
+    from ezdxf.document import Drawing
+    from ezdxf.filemanagement import dxf_stream_info
+    from ezdxf.lldxf.tagger import binary_tags_loader
+    from .storage import is_compressed, open_upload
+
+    if not is_compressed(filepath):
+        return ezdxf.readfile(filepath)
+
+    with open_upload(filepath) as stream:
+        if stream.read(22) == b"AutoCAD Binary DXF\r\n\x1a\x00":
+            stream.seek(0)
+            return Drawing.load(binary_tags_loader(stream.read()))
+
+        stream.seek(0)
+        header = io.TextIOWrapper(stream, encoding="cp1252", errors="ignore")
+        encoding = dxf_stream_info(header).encoding
+        header.detach()
+
+        stream.seek(0)
+        text = io.TextIOWrapper(stream, encoding=encoding, errors="surrogateescape")
+        try:
+            return ezdxf.read(text)
+        finally:
+            text.detach()
+
+
+def get_color_name(color_index: int) -> str:
+    """Get color name from AutoCAD color index"""
+    color_names = {
+        0: "ByBlock", 1: "Red", 2: "Yellow", 3: "Green", 4: "Cyan",
+        5: "Blue", 6: "Magenta", 7: "White/Black", 8: "Dark Gray",
+        9: "Light Gray", 10: "Light Red", 11: "Light Yellow",
+        12: "Light Green", 13: "Light Cyan", 14: "Light Blue",
+        15: "Light Magenta"
+    }
+    return color_names.get(color_index, f"Color {color_index}")
+
+
+def accumulate_layer_stats(entity, counts: dict, lengths: dict, areas: dict):
+    """Add one entity's count, line length and closed area to its layer's totals"""
+    import math
+    layer_name = entity.dxf.layer
+
+    if layer_name not in counts:
+        counts[layer_name] = 0
+        lengths[layer_name] = 0.0
+        areas[layer_name] = 0.0
+
+    counts[layer_name] += 1
+
+    if entity.dxftype() == "LINE":
+        start = entity.dxf.start
+        end = entity.dxf.end
+        length = math.sqrt((end[0] - start[0])**2 + (end[1] - start[1])**2)
+        lengths[layer_name] += length
+
+    elif entity.dxftype() == "LWPOLYLINE":
+        points = list(entity.get_points())
+        if len(points) > 1:
+            length = 0
+            area = 0
+            for i in range(len(points)):
+                x1, y1 = points[i][0], points[i][1]
+                x2, y2 = points[(i + 1) % len(points)][0], points[(i + 1) % len(points)][1]
+                length += math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+                area += (x1 * y2) - (x2 * y1)
+            lengths[layer_name] += length
+            if entity.closed:
+                areas[layer_name] += abs(area) / 2
+
+    elif entity.dxftype() == "HATCH":
+        try:
+            area = entity.total_area
+            areas[layer_name] += area
+        except:
+            pass
+
+
+def make_layer_info(name: str, color: int, visible: bool, counts: dict, lengths: dict, areas: dict):
+    """Build a LayerInfo from a layer table entry and the accumulated totals"""
+    return LayerInfo(
+        name=name,
+        color=color,
+        color_name=get_color_name(color),
+        visible=visible,
+        entity_count=counts.get(name, 0),
+        line_length=round(lengths.get(name, 0.0), 4),
+        closed_area=round(areas.get(name, 0.0), 4)
+    )
+
+
+def extract_layers(doc, store=None):
+    """Extract all layer information from the document.
+
+    Pass the document's ``GeometryStore`` (``build_geometry``) to reuse it.
+    """
+    if store is None:
+        store = build_geometry(doc)
+    counts, lengths, areas = store.layer_stats()
+
+    return [
+        make_layer_info(layer.dxf.name, layer.dxf.color, not layer.is_off(), counts, lengths, areas)
+        for layer in doc.layers
+    ]
+
+
+def make_bounding_box(extmin, extmax):
+    """Build a BoundingBox from two (x, y, z) corners"""
+    min_x, min_y, min_z = extmin
+    max_x, max_y, max_z = extmax
+    return BoundingBox(
+        min_x=min_x, min_y=min_y, min_z=min_z,
+        max_x=max_x, max_y=max_y, max_z=max_z,
+        width=max_x - min_x,
+        height=max_y - min_y,
+        depth=max_z - min_z
+    )
+
+
+def calculate_bounding_box(doc, store=None):
+    """Calculate the bounding box of all entities"""
+    if store is None:
+        store = build_geometry(doc)
+    bounds = store.bounds()
+    if bounds is not None:
+        return make_bounding_box(*bounds)
+    return BoundingBox(min_x=0, min_y=0, min_z=0, max_x=0, max_y=0, max_z=0, width=0, height=0, depth=0)
+
+
+def dimension_data(entity) -> dict:
+    """Describe a DIMENSION entity as plain data"""
+    dim_data = {
+        "type": entity.dxftype(),
+        "layer": entity.dxf.layer,
+        "text": entity.get_text(),
+        "actual_measurement": entity.get_actual_measurement(),
+        "dimstyle": entity.dxf.dimstyle,
+    }
+    if hasattr(entity.dxf, 'defpoint'):
+        dim_data["defpoint"] = list(entity.dxf.defpoint)
+    if hasattr(entity.dxf, 'text_midpoint'):
+        dim_data["text_midpoint"] = list(entity.dxf.text_midpoint)
+    return dim_data
+
+
+def extract_measurements(doc, store=None):
+    """Extract all measurements from the document"""
+    msp = doc.modelspace()
+    if store is None:
+        store = build_geometry(doc)
+    total_entities = len(store)
+
+    bounding_box = calculate_bounding_box(doc, store)
+
+    layers = extract_layers(doc, store)
+    total_line_length = sum(layer.line_length for layer in layers)
+    total_closed_area = sum(layer.closed_area for layer in layers)
+
+    dimensions = []
+    for entity in msp:
+        if entity.dxftype() == "DIMENSION":
+            try:
+                dimensions.append(dimension_data(entity))
+            except Exception as e:
+                print(f"Error extracting dimension: {e}")
+
+    return Measurements(
+        total_entities=total_entities,
+        bounding_box=bounding_box,
+        total_line_length=round(total_line_length, 4),
+        total_closed_area=round(total_closed_area, 4),
+        dimensions=dimensions
+    )
+
+
+def add_entity(builder, entity, extents=None):
+    """Append an entity to a ``GeometryBuilder``.
+
+    ``extents`` is the entity's ``(extmin, extmax)``, if the builder keeps
+    them. Types without preview geometry are added without coordinates, so
+    they still count towards their layer.
+    """
+    from .geometry import ARC, CIRCLE, LINE, LWPOLYLINE, MTEXT, OTHER, TEXT, TYPE_CODES
+
+    entity_type = entity.dxftype()
+    layer = entity.dxf.layer
+    color = entity.dxf.color if hasattr(entity.dxf, 'color') else 7
+    type_code = TYPE_CODES.get(entity_type, OTHER)
+    coords = ()
+    closed = False
+    text = None
+
+    try:
+        if type_code == LINE:
+            start, end = entity.dxf.start, entity.dxf.end
+            coords = (start[0], start[1], end[0], end[1])
+
+        elif type_code == LWPOLYLINE:
+            coords = [v for p in entity.get_points() for v in (p[0], p[1])]
+            closed = entity.closed
+
+        elif type_code == CIRCLE:
+            center = entity.dxf.center
+            coords = (center[0], center[1], entity.dxf.radius)
+
+        elif type_code == ARC:
+            center = entity.dxf.center
+            coords = (center[0], center[1], entity.dxf.radius,
+                      entity.dxf.start_angle, entity.dxf.end_angle)
+
+        elif type_code == TEXT or type_code == MTEXT:
+            insert = entity.dxf.insert
+            rotation = entity.dxf.rotation if hasattr(entity.dxf, 'rotation') else 0
+            if type_code == TEXT:
+                text, height = entity.dxf.text, entity.dxf.height
+            else:
+                text, height = entity.text, entity.dxf.char_height
+            coords = (insert[0], insert[1], height, rotation)
+    except Exception as e:
+        print(f"Error processing entity {entity_type}: {e}")
+        type_code, coords, closed, text = OTHER, (), False, None
+
+    builder.add(type_code, layer, color, coords, closed, text, extents)
+
+
+def build_geometry(doc):
+    """Collect the modelspace entities of a document into a ``GeometryStore``.
+
+    The one pass over the entities that every extractor then works from;
+    each entity's extents are kept for the bounding box.
+    """
+    from ezdxf import bbox
+    from .geometry import GeometryBuilder
+
+    builder = GeometryBuilder(extents=True)
+    for entity in doc.modelspace():
+        try:
+            box = bbox.extents([entity])
+            extents = (box.extmin, box.extmax) if box.has_data else None
+        except Exception as e:
+            print(f"Error calculating extents of {entity.dxftype()}: {e}")
+            extents = None
+        add_entity(builder, entity, extents)
+    return builder.build()
+
+
+def extract_preview_geometry(doc, store=None):
+    """Extract geometry data for 2D preview, as a ``GeometryStore``"""
+    if store is None:
+        store = build_geometry(doc)
+    return calculate_bounding_box(doc, store), store.preview()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB (0 if unknown)"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def binary_copy_path(filepath: str) -> str:
+    """Path of the binary DXF copy kept next to an upload"""
+    import os
+    from .storage import original_path
+    return os.path.splitext(original_path(filepath))[0] + ".bin.dxf"
+
+
+def save_binary_copy(doc, filepath: str):
+    """Save a parsed document as binary DXF next to ``filepath``.
+
+    Binary DXF skips the float and text conversion that dominates loading
+    ASCII DXF, so later cold-cache loads of the same upload are faster.
+    """
+    import os
+    path = binary_copy_path(filepath)
+    tmp_path = path + ".tmp"
+    try:
+        doc.saveas(tmp_path, fmt="bin")
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Could not save binary copy of {filepath}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_binary_copy(filepath: str):
+    """Load the binary DXF copy of ``filepath``, or None if there is none"""
+    import ezdxf
+    import os
+    path = binary_copy_path(filepath)
+    if not os.path.exists(path):
+        return None
+    try:
+        return ezdxf.readfile(path)
+    except Exception as e:
+        print(f"Discarding unreadable binary copy {path}: {e}")
+        os.remove(path)
+        return None
+
+
+def analyze_document(doc):
+    """Run every extractor on a loaded ezdxf document"""
+    store = build_geometry(doc)
+    bounding_box, entities = extract_preview_geometry(doc, store)
+    return {
+        "layers": [layer.model_dump() for layer in extract_layers(doc, store)],
+        "measurements": extract_measurements(doc, store).model_dump(),
+        "preview": {
+            "bounding_box": bounding_box.model_dump(),
+            "entities": entities,
+        },
+    }
+
+
+def analyze_file(filepath: str, streaming_threshold: int = 0, preview_limit: int = 0,
+                 fast_reader: bool = True, loader: Optional[str] = None,
+                 binary_copy: bool = False, share_dir: Optional[str] = None):
+    """Parse a file once and run every extractor on it.
+
+    Runs inside a worker process, so the result is plain data (dicts, lists,
+    floats, and the preview as a ``GeometryStore`` of numpy arrays) that
+    pickles cheaply back to the API process. The tag-level reader
+    in ``tagreader.py`` is tried first when ``fast_reader`` is set. Files larger
+    than ``streaming_threshold`` bytes (0 disables) keep at most
+    ``preview_limit`` preview entities and, if the fast reader can't handle
+    them, are analyzed in a single forward pass (``streaming.py``) instead of
+    being loaded whole. ``loader`` is the ezdxf loader that succeeded on an
+    earlier analysis of the same file; with ``"recover"`` the faster paths,
+    which can't read a malformed file, are skipped.
+
+    With ``binary_copy`` set, files that needed a full ezdxf parse are saved
+    as binary DXF next to the original, and later analyses load that copy
+    instead. With ``share_dir`` set, the preview geometry is handed back
+    through a file in that directory (``geometry.share``) rather than
+    pickled; the caller attaches it. Returns None if the file can't be
+    parsed.
+    """
+    import time
+    from contextlib import ExitStack
+    from .geometry import share
+    from .storage import is_compressed, local_copy, upload_size
+    from .streaming import stream_analyze
+    from .tagreader import fast_analyze
+
+    started = time.perf_counter()
+    result = None
+    fixes = []
+
+    # A copy only exists if the faster paths failed on this file before
+    doc = load_binary_copy(filepath) if binary_copy else None
+    if doc is not None:
+        result = analyze_document(doc)
+        mode = "binary"
+        loader = None
+
+    large = bool(streaming_threshold) and upload_size(filepath) > streaming_threshold
+    known_bad = loader == "recover"
+
+    with ExitStack() as stack:
+        # Small compressed files are decompressed in memory; large ones get a
+        # temporary plain copy so the readers can map or stream it
+        source = filepath
+        if result is None and large and is_compressed(filepath):
+            source = stack.enter_context(local_copy(filepath))
+
+        if result is None and fast_reader and not known_bad:
+            result = fast_analyze(source, preview_limit if large else None)
+            mode = "fast"
+
+        if result is None and large and not known_bad:
+            result = stream_analyze(source, preview_limit)
+            mode = "streaming"
+
+        if result is None:
+            doc, loader, fixes = parse_dxf_file(source, loader)
+            if doc is None:
+                return None
+
+            result = analyze_document(doc)
+            mode = "recover" if loader == "recover" else "full"
+            if binary_copy:
+                save_binary_copy(doc, filepath)
+
+    result["metadata"] = {
+        "mode": mode,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "peak_rss_mb": peak_rss_mb(),
+        "loader": loader if mode in ("full", "recover") else None,
+        "fixes": fixes,
+    }
+    if share_dir:
+        result["preview"]["entities"] = share(result["preview"]["entities"], share_dir)
+    return result
@@ -0,0 +1,406 @@
+"""SQLite store of uploaded files' metadata.
+
+Uploads are tracked in one table, so the list survives restarts and can be
+shared by several API processes (WAL mode lets readers and a writer work
+concurrently). Listing is paginated with keyset cursors: a cursor holds the
+sort value and id of the last file of a page, and the next page starts
+right after it. The ``(column, id)`` indexes, with and without the type in
+front, let every page be read straight off an index, so a page costs the
+same whether 100 or 100k files are stored.
+
+Uploads are stored by content (see ``storage``), and several files can
+share one stored blob. ``blobs`` counts the files referencing each content
+hash. Adding or deleting a file changes the count in the same write
+transaction that puts the blob in place or removes it, and SQLite lets one
+write transaction run at a time across processes, so an upload never
+counts on a blob that a concurrent delete is removing.
+
+Chunked uploads in progress are kept here too: a session per upload and
+the byte ranges received, so an upload can be resumed after a dropped
+connection or a restart, from any API process.
+
+Calls block on disk I/O; the API runs them in the threadpool.
+"""
+import base64
+import json
+import os
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .models import FileInfo, UploadSession
+
+SORT_COLUMNS = ("upload_time", "file_size")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    upload_time TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    loader TEXT,
+    fixes TEXT NOT NULL,
+    sha256 TEXT
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    created TEXT NOT NULL,
+    chunk_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    session_id TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_chunks_session ON upload_chunks (session_id, start);
+CREATE INDEX IF NOT EXISTS files_upload_time ON files (upload_time, id);
+CREATE INDEX IF NOT EXISTS files_file_size ON files (file_size, id);
+CREATE INDEX IF NOT EXISTS files_type_upload_time ON files (file_type, upload_time, id);
+CREATE INDEX IF NOT EXISTS files_type_file_size ON files (file_type, file_size, id);
+"""
+# Columns added since the first schema, created on databases that lack them.
+# ``owner`` is the process analyzing a file, as "<host>:<pid>".
+_ADDED_COLUMNS = {"sha256": "TEXT", "owner": "TEXT"}
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+"""
+_COLUMNS = ("id", "filename", "file_size", "upload_time", "file_type", "status", "error",
+            "loader", "fixes", "sha256")
+
+
+class InvalidCursor(ValueError):
+    """A listing cursor is malformed or belongs to another sort order"""
+
+
+def _to_row(info: FileInfo) -> tuple:
+    return (info.id, info.filename, info.file_size,
+            info.upload_time.isoformat(timespec="microseconds"), info.file_type,
+            info.status, info.error, info.loader, json.dumps(info.fixes), info.sha256)
+
+
+def _from_row(row: tuple) -> FileInfo:
+    values = dict(zip(_COLUMNS, row))
+    values["fixes"] = json.loads(values["fixes"])
+    return FileInfo(**values)
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[List[int]]:
+    """Sorted, merged ``[start, end)`` ranges covering the given ones"""
+    merged: List[List[int]] = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def encode_cursor(sort: str, value, file_id: str) -> str:
+    data = json.dumps([sort, value, file_id]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, str]:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, file_id = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+    if cursor_sort != sort:
+        raise InvalidCursor(f"Cursor is for sorting by {cursor_sort}, not {sort}")
+    return value, file_id
+
+
+class FileStore:
+    """Metadata of the uploaded files, kept in a SQLite database.
+
+    One connection is shared by the threads of a process and serialized by
+    a lock; other processes open their own. A file set to ``processing`` is
+    marked as analyzed by this process, so that another one starting up
+    leaves it alone (see ``requeue_interrupted``).
+    """
+
+    def __init__(self, path: str):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(files)")}
+        for name, column_type in _ADDED_COLUMNS.items():
+            if name not in existing:
+                self._db.execute(f"ALTER TABLE files ADD COLUMN {name} {column_type}")
+        self._db.executescript(_INDEXES)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Hold the database's write lock, committing unless an exception is raised"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _reference(self, sha256: str):
+        self._db.execute(
+            "INSERT INTO blobs (sha256, refcount) VALUES (?, 1)"
+            " ON CONFLICT (sha256) DO UPDATE SET refcount = refcount + 1",
+            (sha256,)
+        )
+
+    def add(self, info: FileInfo, store: Optional[Callable[[], object]] = None):
+        """Add a file, counting a reference to its content.
+
+        ``store`` puts the content in place; it runs inside the transaction,
+        and the file isn't added if it raises.
+        """
+        with self._transaction():
+            if store is not None:
+                store()
+            self._db.execute(
+                f"INSERT INTO files ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                _to_row(info)
+            )
+            if info.sha256 is not None:
+                self._reference(info.sha256)
+
+    def adopt(self, file_id: str, sha256: str, store: Callable[[], bool]) -> bool:
+        """Move a file stored under its id into content storage.
+
+        ``store`` runs inside the transaction and returns whether it moved
+        the file, which it doesn't if another request got there first.
+        """
+        with self._transaction():
+            if not store():
+                return False
+            self._db.execute("UPDATE files SET sha256 = ? WHERE id = ?", (sha256, file_id))
+            self._reference(sha256)
+            return True
+
+    def get(self, file_id: str) -> Optional[FileInfo]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM files WHERE id = ?", (file_id,)
+            ).fetchone()
+        return None if row is None else _from_row(row)
+
+    def exists(self, file_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM files WHERE id = ?", (file_id,)).fetchone() is not None
+
+    def update(self, file_id: str, **fields) -> bool:
+        """Set some of a file's fields; returns False if the file is gone"""
+        unknown = set(fields) - set(_COLUMNS[1:])
+        if unknown:
+            raise ValueError(f"Unknown fields: {sorted(unknown)}")
+        if "fixes" in fields:
+            fields["fixes"] = json.dumps(fields["fixes"])
+        if fields.get("status") == "processing":
+            fields["owner"] = self.owner
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE files SET {assignments} WHERE id = ?", (*fields.values(), file_id)
+            )
+        return cursor.rowcount > 0
+
+    def find_content(self, sha256: str) -> Optional[FileInfo]:
+        """A file with the given content, analyzed ones first"""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM files WHERE sha256 = ?"
+                " ORDER BY status = 'ready' DESC LIMIT 1",
+                (sha256,)
+            ).fetchone()
+        return None if row is None else _from_row(row)
+
+    def update_content(self, sha256: str, **fields) -> int:
+        """Set some fields of every file with the given content; returns how many"""
+        unknown = set(fields) - set(_COLUMNS[1:])
+        if unknown:
+            raise ValueError(f"Unknown fields: {sorted(unknown)}")
+        if "fixes" in fields:
+            fields["fixes"] = json.dumps(fields["fixes"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            return self._db.execute(
+                f"UPDATE files SET {assignments} WHERE sha256 = ?", (*fields.values(), sha256)
+            ).rowcount
+
+    def references(self, sha256: str) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def delete(self, file_id: str,
+               release: Optional[Callable[[FileInfo], object]] = None) -> Optional[FileInfo]:
+        """Delete a file; returns it, or None if there was no such file.
+
+        ``release`` is called with the file, inside the transaction, when it
+        held the last reference to its content (or its content isn't shared),
+        to remove the stored content.
+        """
+        with self._transaction():
+            row = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM files WHERE id = ?", (file_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            info = _from_row(row)
+            self._db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            remaining = None
+            if info.sha256 is not None:
+                counted = self._db.execute(
+                    "UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ? RETURNING refcount",
+                    (info.sha256,)
+                ).fetchone()
+                if counted is not None:
+                    remaining = counted[0]
+                    if remaining <= 0:
+                        self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (info.sha256,))
+            if not remaining and release is not None:
+                release(info)
+            return info
+
+    def requeue_interrupted(self, alive: Callable[[int], bool]) -> int:
+        """Mark files whose analysis was cut short by a restart as queued.
+
+        Called as the process starts: a file is requeued if the process that
+        was analyzing it ran on this host and is gone, as ``alive`` tells
+        from its pid, or had this process' pid (a previous run). Files of
+        other hosts are left to those hosts, and files from before owners
+        were recorded are requeued.
+        """
+        host, _, pid = self.owner.rpartition(":")
+        with self._transaction():
+            interrupted = []
+            for file_id, owner in self._db.execute(
+                "SELECT id, owner FROM files WHERE status = 'processing'"
+            ).fetchall():
+                owner_host, _, owner_pid = (owner or "").rpartition(":")
+                if (owner is None
+                        or owner_host == host and (owner_pid == pid or not alive(int(owner_pid)))):
+                    interrupted.append((file_id,))
+            self._db.executemany(
+                "UPDATE files SET status = 'queued' WHERE id = ? AND status = 'processing'",
+                interrupted
+            )
+            return len(interrupted)
+
+    def list(self, sort: str = "upload_time", descending: bool = True,
+             file_type: Optional[str] = None, limit: int = 50,
+             cursor: Optional[str] = None) -> Tuple[List[FileInfo], Optional[str]]:
+        """One page of files and the cursor of the next page (None on the last).
+
+        Raises ``InvalidCursor`` for a cursor of another sort column.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Can't sort by {sort}")
+        where, params = [], []
+        if file_type is not None:
+            where.append("file_type = ?")
+            params.append(file_type)
+        if cursor is not None:
+            value, file_id = decode_cursor(cursor, sort)
+            where.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            params += [value, file_id]
+        direction = "DESC" if descending else "ASC"
+        query = (
+            f"SELECT {', '.join(_COLUMNS)} FROM files"
+            f"{' WHERE ' + ' AND '.join(where) if where else ''}"
+            f" ORDER BY {sort} {direction}, id {direction} LIMIT ?"
+        )
+        with self._lock:
+            rows = self._db.execute(query, (*params, limit + 1)).fetchall()
+
+        files = [_from_row(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(sort, last[_COLUMNS.index(sort)], last[0])
+        return files, next_cursor
+
+    def add_session(self, session: UploadSession):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO upload_sessions (id, filename, size, sha256, created, chunk_size)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (session.upload_id, session.filename, session.size, session.sha256,
+                 session.created.isoformat(timespec="microseconds"), session.chunk_size)
+            )
+
+    def get_session(self, upload_id: str) -> Optional[UploadSession]:
+        """A chunked upload with the ranges received so far"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, filename, size, sha256, created, chunk_size FROM upload_sessions"
+                " WHERE id = ?", (upload_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            ranges = self._db.execute(
+                "SELECT start, stop FROM upload_chunks WHERE session_id = ?", (upload_id,)
+            ).fetchall()
+        received = merge_ranges(ranges)
+        size = row[2]
+        return UploadSession(
+            upload_id=row[0], filename=row[1], size=size, sha256=row[3], created=row[4],
+            chunk_size=row[5], received=received,
+            complete=size == 0 or received == [[0, size]]
+        )
+
+    def add_chunk(self, upload_id: str, start: int, stop: int) -> bool:
+        """Record a received byte range; returns False if the upload is gone"""
+        with self._transaction():
+            if self._db.execute("SELECT 1 FROM upload_sessions WHERE id = ?",
+                                (upload_id,)).fetchone() is None:
+                return False
+            self._db.execute(
+                "INSERT INTO upload_chunks (session_id, start, stop) VALUES (?, ?, ?)",
+                (upload_id, start, stop)
+            )
+            return True
+
+    def discard_chunks(self, upload_id: str, start: int, stop: int):
+        """Forget the received ranges overlapping ``[start, stop)``, which a
+        failed chunk may have overwritten"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM upload_chunks WHERE session_id = ? AND start < ? AND stop > ?",
+                (upload_id, stop, start)
+            )
+
+    def delete_session(self, upload_id: str) -> bool:
+        """Forget a chunked upload; only one of concurrent callers gets True"""
+        with self._transaction():
+            self._db.execute("DELETE FROM upload_chunks WHERE session_id = ?", (upload_id,))
+            return self._db.execute(
+                "DELETE FROM upload_sessions WHERE id = ?", (upload_id,)
+            ).rowcount > 0
+
+    def expired_sessions(self, before: datetime) -> List[UploadSession]:
+        """Chunked uploads started before ``before``"""
+        with self._lock:
+            ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM upload_sessions WHERE created < ?",
+                (before.isoformat(timespec="microseconds"),)
+            )]
+        return [session for session in map(self.get_session, ids) if session is not None]
@@ -0,0 +1,422 @@
+"""Columnar (struct-of-arrays) storage of a drawing's entities.
+
+Building a dict or a pydantic model per entity costs far more than the
+geometry itself and leaves hundreds of small objects per entity for the
+garbage collector. A ``GeometryStore`` instead keeps one typed array per
+field: entity type codes, layer indices (into ``layer_names``), colours and
+flags, and all coordinates in a single float64 buffer that ``offsets``
+slices per entity. Layer statistics, extents and the preview are computed
+from the arrays with numpy, and entity dicts are only built when a preview
+is serialized for a response.
+
+Coordinates per entity type:
+
+    LINE        x1 y1 x2 y2
+    LWPOLYLINE  x0 y0 x1 y1 ...
+    CIRCLE      cx cy radius
+    ARC         cx cy radius start_angle end_angle
+    TEXT/MTEXT  x y height rotation (the string is in ``texts``)
+
+Other types have no coordinates; they only count towards their layer and,
+when the store keeps them, the extents.
+
+Worker processes hand their geometry back with ``share``: the columns are
+written into one file (on tmpfs where there is one) and only a small
+``SharedGeometry`` descriptor is pickled. The receiving process maps the
+file and unlinks it, so the arrays cost one write in the worker instead of
+a pickle, a copy through the pipe and an unpickle.
+"""
+import json
+import math
+import mmap
+import os
+import shutil
+import tempfile
+from array import array
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+ENTITY_TYPES = ("LINE", "LWPOLYLINE", "CIRCLE", "ARC", "TEXT", "MTEXT", "HATCH", "DIMENSION", "OTHER")
+LINE, LWPOLYLINE, CIRCLE, ARC, TEXT, MTEXT, HATCH, DIMENSION, OTHER = range(len(ENTITY_TYPES))
+TYPE_CODES = {name: code for code, name in enumerate(ENTITY_TYPES) if code != OTHER}
+
+# Types drawn by the preview
+PREVIEW_TYPES = (LINE, LWPOLYLINE, CIRCLE, ARC, TEXT, MTEXT)
+PREVIEW_TYPE_NAMES = frozenset(ENTITY_TYPES[code] for code in PREVIEW_TYPES)
+
+# Bits of ``flags``
+CLOSED = 1
+
+# Columns written as one ``.npy`` file each by ``GeometryStore.save``
+_COLUMNS = ("types", "layers", "colors", "flags", "offsets", "coords", "text_ids", "extents")
+_STRINGS = "strings.json"
+# Alignment of the columns in a shared file
+_ALIGN = 64
+
+
+class GeometryBuilder:
+    """Appends entities to growable typed arrays and turns them into a store.
+
+    With ``extents`` set, every entity also records its (x, y, z) extents,
+    NaN if it has none. Builders pickle compactly, so worker processes
+    return them as they are.
+    """
+
+    def __init__(self, extents: bool = False):
+        self.types = array("B")
+        self.layers = array("i")
+        self.colors = array("h")
+        self.flags = array("B")
+        self.offsets = array("q", [0])
+        self.coords = array("d")
+        self.text_ids = array("i")
+        self.texts = []
+        self.layer_names = []
+        self._layer_index = {}
+        self.extents = array("d") if extents else None
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def layer_index(self, name: str) -> int:
+        index = self._layer_index.get(name)
+        if index is None:
+            index = self._layer_index[name] = len(self.layer_names)
+            self.layer_names.append(name)
+        return index
+
+    def add(self, type_code: int, layer: str, color: int, coords: Sequence[float] = (),
+            closed: bool = False, text: Optional[str] = None, extents=None):
+        """Append one entity; ``extents`` is ``(extmin, extmax)`` or None"""
+        self.types.append(type_code)
+        self.layers.append(self.layer_index(layer))
+        self.colors.append(color)
+        self.flags.append(CLOSED if closed else 0)
+        self.coords.extend(coords)
+        self.offsets.append(len(self.coords))
+        if text is None:
+            self.text_ids.append(-1)
+        else:
+            self.text_ids.append(len(self.texts))
+            self.texts.append(text)
+        if self.extents is not None:
+            if extents is None:
+                self.extents.extend((np.nan,) * 6)
+            else:
+                self.extents.extend(extents[0])
+                self.extents.extend(extents[1])
+
+    def extend(self, other, limit: Optional[int] = None):
+        """Append the first ``limit`` entities (all by default) of another
+        builder or of a ``GeometryStore``"""
+        count = len(other) if limit is None else max(0, min(limit, len(other)))
+        if not count:
+            return
+        remap = np.array([self.layer_index(name) for name in other.layer_names], dtype=np.int32)
+        offsets = np.asarray(other.offsets)[:count + 1]
+        text_ids = np.asarray(other.text_ids)[:count]
+        has_text = text_ids >= 0
+
+        _append(self.types, np.asarray(other.types)[:count])
+        _append(self.layers, remap[np.asarray(other.layers)[:count]])
+        _append(self.colors, np.asarray(other.colors)[:count])
+        _append(self.flags, np.asarray(other.flags)[:count])
+        _append(self.offsets, offsets[1:] - offsets[0] + len(self.coords))
+        _append(self.coords, np.asarray(other.coords)[offsets[0]:offsets[-1]])
+        _append(self.text_ids, np.where(has_text, len(self.texts) + np.cumsum(has_text) - 1, -1))
+        self.texts.extend(other.texts[i] for i in text_ids[has_text].tolist())
+        if self.extents is not None:
+            if other.extents is None:
+                self.extents.extend((np.nan,) * (6 * count))
+            else:
+                _append(self.extents, np.asarray(other.extents).reshape(-1)[:6 * count])
+
+    def build(self, start: int = 0, stop: Optional[int] = None) -> "GeometryStore":
+        """A store of the entities added so far from the ``start``-th up to
+        the ``stop``-th (a copy; the builder can keep growing)"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)[start:stop + 1]
+        text_ids = np.frombuffer(self.text_ids, dtype=np.int32)[start:stop]
+        # Texts are added in entity order, so those of the copied entities
+        # are a contiguous run of the list
+        with_text = text_ids[text_ids >= 0]
+        first_text = int(with_text[0]) if len(with_text) else len(self.texts)
+        end_text = int(with_text[-1]) + 1 if len(with_text) else first_text
+        return GeometryStore(
+            types=_copy(self.types, np.uint8, start, stop),
+            layers=_copy(self.layers, np.int32, start, stop),
+            colors=_copy(self.colors, np.int16, start, stop),
+            flags=_copy(self.flags, np.uint8, start, stop),
+            offsets=offsets - offsets[0],
+            coords=_copy(self.coords, np.float64, int(offsets[0]), int(offsets[-1])),
+            text_ids=np.where(text_ids >= 0, text_ids - first_text, -1).astype(np.int32),
+            texts=self.texts[first_text:end_text],
+            layer_names=list(self.layer_names),
+            extents=None if self.extents is None
+            else _copy(self.extents, np.float64, 6 * start, 6 * stop).reshape(-1, 6),
+        )
+
+
+def _copy(values: array, dtype, start: int, stop: int) -> np.ndarray:
+    """A numpy copy of ``values[start:stop]``"""
+    return np.frombuffer(values, dtype=dtype)[start:stop].copy()
+
+
+def _append(target: array, values: np.ndarray):
+    """Append a numpy array to an ``array.array`` without a Python loop"""
+    target.frombytes(np.ascontiguousarray(values, dtype=target.typecode).view(np.uint8))
+
+
+class GeometryStore:
+    """The entities of a drawing as parallel numpy arrays.
+
+    ``offsets`` has one more element than there are entities; entity ``i``
+    owns ``coords[offsets[i]:offsets[i + 1]]``. Offsets are absolute, so a
+    slice of a store shares the coordinate buffer of the original.
+    """
+
+    def __init__(self, types, layers, colors, flags, offsets, coords, text_ids, texts,
+                 layer_names, extents=None):
+        self.types = types
+        self.layers = layers
+        self.colors = colors
+        self.flags = flags
+        self.offsets = offsets
+        self.coords = coords
+        self.text_ids = text_ids
+        self.texts = texts
+        self.layer_names = layer_names
+        self.extents = extents
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def save(self, directory: str):
+        """Write the store into ``directory`` as ``.npy`` files and a JSON file of strings"""
+        for name in _COLUMNS:
+            column = getattr(self, name)
+            if column is not None:
+                np.save(os.path.join(directory, f"{name}.npy"), column)
+        with open(os.path.join(directory, _STRINGS), "w") as f:
+            json.dump({"texts": self.texts, "layer_names": self.layer_names}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "GeometryStore":
+        """Read a store written by ``save``, memory-mapping its arrays by default.
+
+        Mapped arrays are read-only and are paged in from the OS page cache
+        as they are used, so loading costs next to nothing until then.
+        """
+        columns = {}
+        for name in _COLUMNS:
+            path = os.path.join(directory, f"{name}.npy")
+            if name == "extents" and not os.path.exists(path):
+                columns[name] = None
+            else:
+                columns[name] = np.load(path, mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, _STRINGS)) as f:
+            strings = json.load(f)
+        return cls(texts=strings["texts"], layer_names=strings["layer_names"], **columns)
+
+    def __getitem__(self, index: slice) -> "GeometryStore":
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("GeometryStore slices must be contiguous")
+        stop = max(start, stop)
+        return GeometryStore(
+            self.types[start:stop], self.layers[start:stop], self.colors[start:stop],
+            self.flags[start:stop], self.offsets[start:stop + 1], self.coords,
+            self.text_ids[start:stop], self.texts, self.layer_names,
+            None if self.extents is None else self.extents[start:stop],
+        )
+
+    def select(self, mask: np.ndarray) -> "GeometryStore":
+        """A compacted store of the entities where ``mask`` is true"""
+        index = np.flatnonzero(mask)
+        starts = self.offsets[:-1][index]
+        sizes = self.offsets[1:][index] - starts
+        offsets = np.zeros(len(index) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        # Position of every kept coordinate in the old buffer
+        gather = np.repeat(starts - offsets[:-1], sizes) + np.arange(offsets[-1])
+        return GeometryStore(
+            self.types[index], self.layers[index], self.colors[index], self.flags[index],
+            offsets, self.coords[gather], self.text_ids[index], self.texts, self.layer_names,
+            None if self.extents is None else self.extents[index],
+        )
+
+    def preview(self) -> "GeometryStore":
+        """The entities the preview draws"""
+        return self.select(np.isin(self.types, PREVIEW_TYPES))
+
+    def layer_stats(self) -> Tuple[Dict[str, int], Dict[str, float], Dict[str, float]]:
+        """Per-layer entity counts, line lengths and closed areas.
+
+        Lines count their 2D length. Polylines count their perimeter
+        including the closing segment (as ``accumulate_layer_stats`` does)
+        and, if closed, their shoelace area; other types only count.
+        """
+        nlayers = len(self.layer_names)
+        counts = np.bincount(self.layers, minlength=nlayers)
+        lengths = np.zeros(nlayers)
+        areas = np.zeros(nlayers)
+        coords = self.coords
+        starts = self.offsets[:-1]
+
+        lines = self.types == LINE
+        if lines.any():
+            o = starts[lines]
+            dx = coords[o + 2] - coords[o]
+            dy = coords[o + 3] - coords[o + 1]
+            lengths += np.bincount(self.layers[lines], np.sqrt(dx * dx + dy * dy), nlayers)
+
+        polylines = self.types == LWPOLYLINE
+        if polylines.any():
+            first = starts[polylines]
+            npoints = (self.offsets[1:][polylines] - first) // 2
+            owner = np.repeat(np.arange(len(first)), npoints)
+            # Index of every vertex within its polyline and of the vertex after it
+            vertex = np.arange(npoints.sum()) - np.repeat(np.cumsum(npoints) - npoints, npoints)
+            following = vertex + 1
+            following[following == np.repeat(npoints, npoints)] = 0
+            base = np.repeat(first, npoints)
+            x1 = coords[base + 2 * vertex]
+            y1 = coords[base + 2 * vertex + 1]
+            x2 = coords[base + 2 * following]
+            y2 = coords[base + 2 * following + 1]
+            perimeter = np.bincount(owner, np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2), len(first))
+            shoelace = np.bincount(owner, x1 * y2 - x2 * y1, len(first))
+            layers = self.layers[polylines]
+            lengths += np.bincount(layers, perimeter, nlayers)
+            closed = (self.flags[polylines] & CLOSED).astype(bool)
+            areas += np.bincount(layers[closed], np.abs(shoelace[closed]) / 2, nlayers)
+
+        return (
+            {name: int(counts[i]) for i, name in enumerate(self.layer_names)},
+            {name: float(lengths[i]) for i, name in enumerate(self.layer_names)},
+            {name: float(areas[i]) for i, name in enumerate(self.layer_names)},
+        )
+
+    def bounds(self):
+        """``(extmin, extmax)`` over the recorded extents, or None if there are none"""
+        if self.extents is None:
+            return None
+        known = ~np.isnan(self.extents[:, 0])
+        if not known.any():
+            return None
+        extents = self.extents[known]
+        return extents[:, :3].min(axis=0).tolist(), extents[:, 3:].max(axis=0).tolist()
+
+    def to_dicts(self, start: int = 0):
+        """Preview entity dicts (``{type, layer, color, data}``) from ``start`` on"""
+        store = self[start:]
+        base = int(store.offsets[0])
+        coords = store.coords[base:int(store.offsets[-1])].tolist()
+        offsets = (store.offsets - base).tolist()
+        flags = store.flags.tolist()
+        text_ids = store.text_ids.tolist()
+        layer_names = store.layer_names
+        texts = store.texts
+
+        entities = []
+        for i, (type_code, layer, color) in enumerate(
+                zip(store.types.tolist(), store.layers.tolist(), store.colors.tolist())):
+            o = offsets[i]
+            if type_code == LINE:
+                data = {"start": coords[o:o + 2], "end": coords[o + 2:o + 4]}
+            elif type_code == LWPOLYLINE:
+                points = coords[o:offsets[i + 1]]
+                data = {"points": [points[j:j + 2] for j in range(0, len(points), 2)],
+                        "closed": bool(flags[i] & CLOSED)}
+            elif type_code == CIRCLE:
+                data = {"center": coords[o:o + 2], "radius": coords[o + 2]}
+            elif type_code == ARC:
+                data = {"center": coords[o:o + 2], "radius": coords[o + 2],
+                        "start_angle": coords[o + 3], "end_angle": coords[o + 4]}
+            elif type_code == TEXT or type_code == MTEXT:
+                data = {"position": coords[o:o + 2], "text": texts[text_ids[i]],
+                        "height": coords[o + 2], "rotation": coords[o + 3]}
+            else:
+                continue
+            entities.append({"type": ENTITY_TYPES[type_code], "layer": layer_names[layer],
+                             "color": color, "data": data})
+        return entities
+
+
+class SharedGeometry:
+    """A builder's or store's columns in a file, waiting for ``attach``"""
+
+    def __init__(self, path: str, columns, texts, layer_names):
+        self.path = path
+        self.columns = columns
+        self.texts = texts
+        self.layer_names = layer_names
+
+    def attach(self) -> GeometryStore:
+        """Map the columns into this process as a read-only store.
+
+        The file is unlinked straight away; the mapping keeps its pages
+        until the store's arrays are garbage collected.
+        """
+        with open(self.path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.release()
+        arrays = {"extents": None}
+        for name, dtype, shape, offset in self.columns:
+            arrays[name] = np.frombuffer(buf, dtype, math.prod(shape), offset).reshape(shape)
+        return GeometryStore(texts=self.texts, layer_names=self.layer_names, **arrays)
+
+    def release(self):
+        """Delete the file without mapping it"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def share(geometry, directory: str):
+    """Write the columns of a builder or store into a new file in ``directory``.
+
+    Returns a ``SharedGeometry`` to pass to another process instead of
+    ``geometry``, or ``geometry`` itself if the file can't be written (it
+    is then pickled as usual).
+    """
+    columns = []
+    path = None
+    try:
+        fd, path = tempfile.mkstemp(suffix=".geom", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            for name in _COLUMNS:
+                column = getattr(geometry, name)
+                if column is None:
+                    continue
+                column = np.ascontiguousarray(column)
+                if name == "extents":
+                    column = column.reshape(-1, 6)
+                f.write(b"\0" * (-f.tell() % _ALIGN))
+                columns.append((name, column.dtype.str, column.shape, f.tell()))
+                f.write(column.reshape(-1).view(np.uint8))
+    except OSError as e:
+        print(f"Could not share geometry through {directory}: {e}")
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        return geometry
+    return SharedGeometry(path, columns, list(geometry.texts), list(geometry.layer_names))
+
+
+def attach(geometry):
+    """The store behind ``geometry`` if it was shared, else ``geometry``"""
+    return geometry.attach() if isinstance(geometry, SharedGeometry) else geometry
+
+
+def release(geometry):
+    """Drop shared geometry that won't be attached"""
+    if isinstance(geometry, SharedGeometry):
+        geometry.release()
+
+
+def release_directory(directory: str):
+    """Delete ``directory`` along with the shared geometry nobody attached"""
+    shutil.rmtree(directory, ignore_errors=True)
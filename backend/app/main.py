@@ -1,13 +1,38 @@
 """FastAPI main application for DWG Dashboard"""
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional, Any
-from datetime import datetime
-from typing_extensions import Self
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, List, Literal, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import contextlib
+import hashlib
+import math
 import os
+import tempfile
 import uuid
-import shutil
+from functools import partial
+
+from .admission import MemoryBudget, estimate_analysis
+from .cache import AnalysisCache
+from .dwg_service import analyze_file, binary_copy_path, extractor_version
+from .filestore import FileStore, InvalidCursor
+from .geometry import attach, release_directory
+from .models import (
+    AnalysisMetadata, FileInfo, FileListResponse, HashUploadRequest, UploadInitRequest, UploadResponse,
+    UploadSession, LayerResponse, MeasurementResponse, PreviewResponse
+)
+from .parallel import AnalysisProgress, parallel_analyze
+from .sampling import approx_analyze
+from .singleflight import SingleFlight, WorkAbandoned
+from .storage import (
+    COPY_CHUNK, DRAWING_EXTENSIONS, UploadTooLarge, allocate_upload, blob_path, content_hash,
+    decompressed_copy, find_upload, is_compressed, open_drawing, original_path, store_blob,
+    upload_size, write_at, write_upload
+)
+from .tagreader import quick_layers
+from .workers import AnalysisOutOfMemory, AnalysisTimeout, WorkerCrashed, WorkerPool, process_alive
 
 app = FastAPI(
     title="DWG Dashboard API",
@@ -24,102 +49,122 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for file metadata (use database in production)
-file_storage = {}
 UPLOAD_DIR = "/tmp/uploads"
+# Drawings stored by content hash, and uploads still being written
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+INCOMING_DIR = os.path.join(UPLOAD_DIR, "incoming")
+
+# Ensure upload directories exist
+for directory in (UPLOAD_DIR, BLOB_DIR, INCOMING_DIR):
+    os.makedirs(directory, exist_ok=True)
+# SQLite database of the uploaded files' metadata
+METADATA_DB = os.environ.get("METADATA_DB", os.path.join(UPLOAD_DIR, "files.db"))
+file_store = FileStore(METADATA_DB)
+# Store uploads gzip-compressed (decompressed as they are read)
+COMPRESS_UPLOADS = os.environ.get("COMPRESS_UPLOADS", "1") == "1"
+# Largest drawing accepted, measured after decompressing .gz/.zip uploads
+MAX_UPLOAD_MB = float(os.environ.get("MAX_UPLOAD_MB", "500"))
+# Chunked uploads: the chunk size suggested to clients, and how long an
+# unfinished upload is kept for resuming
+UPLOAD_CHUNK_MB = float(os.environ.get("UPLOAD_CHUNK_MB", "8"))
+UPLOAD_SESSION_HOURS = float(os.environ.get("UPLOAD_SESSION_HOURS", "24"))
+
+# Concurrent requests for the same content share one analysis
+inflight = SingleFlight()
+# Chunks merged so far by running analyses (by cache key), for requests
+# with a deadline
+analysis_progress: Dict[str, AnalysisProgress] = {}
+# Byte ranges of chunked uploads being written or committed, by upload id
+upload_claims: Dict[str, List[Tuple[int, int, asyncio.Future]]] = {}
+
+# Parsing and extraction run in worker processes, off the event loop
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "1"))
+PARSE_MAX_TASKS_PER_WORKER = int(os.environ.get("PARSE_MAX_TASKS_PER_WORKER", "10"))
+PARSE_TIMEOUT = float(os.environ.get("PARSE_TIMEOUT", "300"))
+# Address-space cap per worker process, so one drawing can't exhaust the host
+PARSE_MEMORY_LIMIT_MB = float(os.environ.get("PARSE_MEMORY_LIMIT_MB", "1024"))
+# Files above this size are analyzed in a single streaming pass
+STREAMING_THRESHOLD_MB = float(os.environ.get("STREAMING_THRESHOLD_MB", "50"))
+STREAMING_PREVIEW_LIMIT = int(os.environ.get("STREAMING_PREVIEW_LIMIT", "50000"))
+# Tag-level reader tried before ezdxf for the common entity types
+FAST_READER = os.environ.get("FAST_READER", "1") == "1"
+# Files above this size have their entities scanned in chunks by all workers
+# at once, with results available chunk by chunk to requests with a deadline
+PARALLEL_THRESHOLD_MB = float(os.environ.get("PARALLEL_THRESHOLD_MB", "20"))
+PARALLEL_CHUNK_MB = float(os.environ.get("PARALLEL_CHUNK_MB", "8"))
+# Preview entities per response to a request with a deadline, which bounds
+# the time copying and serializing them takes after the deadline; the
+# continuation token picks up the rest (0 sends them all)
+DEADLINE_PREVIEW_LIMIT = int(os.environ.get("DEADLINE_PREVIEW_LIMIT", "10000"))
+# Longest such a request waits for a chunk being merged before it answers
+# with the chunks merged before it
+SNAPSHOT_WAIT_S = 0.05
+# Bytes of the ENTITIES section scanned for ?mode=approx estimates
+APPROX_SAMPLE_MB = float(os.environ.get("APPROX_SAMPLE_MB", "4"))
+# Keep a binary DXF copy of files that needed a full ezdxf parse
+BINARY_DXF_COPY = os.environ.get("BINARY_DXF_COPY", "1") == "1"
+# Workers hand preview geometry back through memory-mapped files in a
+# private directory (on tmpfs where there is one) instead of pickling it
+SHARED_RESULTS = os.environ.get("SHARED_RESULTS", "1") == "1"
+shared_results_dir: Optional[str] = None
+# Analyses only start while their summed memory estimates fit in this budget
+PARSE_MEMORY_BUDGET_MB = float(os.environ.get("PARSE_MEMORY_BUDGET_MB", "768"))
+memory_budget = MemoryBudget(PARSE_MEMORY_BUDGET_MB)
+worker_pool = WorkerPool(
+    max_workers=PARSE_WORKERS,
+    max_tasks_per_child=PARSE_MAX_TASKS_PER_WORKER,
+    timeout=PARSE_TIMEOUT,
+    memory_limit_mb=PARSE_MEMORY_LIMIT_MB
+)
 
-# Ensure upload directory exists
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-
-# Pydantic Models
-class LayerInfo(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    name: str
-    color: int
-    color_name: str
-    visible: bool
-    entity_count: int
-    line_length: float
-    closed_area: float = 0.0
-
-
-class BoundingBox(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    min_x: float
-    min_y: float
-    min_z: float
-    max_x: float
-    max_y: float
-    max_z: float
-    width: float
-    height: float
-    depth: float
-
-
-class Measurements(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    total_entities: int
-    bounding_box: BoundingBox
-    total_line_length: float
-    total_closed_area: float
-    dimensions: List[dict]
-
-
-class FileInfo(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    id: str
-    filename: str
-    file_size: int
-    upload_time: datetime
-    file_type: str
-
-
-class UploadResponse(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    success: bool
-    file_id: str
-    filename: str
-    message: str
-
-
-class LayerResponse(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    file_id: str
-    filename: str
-    layers: List[LayerInfo]
-
+# Analysis results shared by the layers/measurements/preview endpoints, by
+# content hash and extractor version: in memory, then as memory-mapped
+# sidecars on disk that survive restarts
+ANALYSIS_CACHE_SIZE = int(os.environ.get("ANALYSIS_CACHE_SIZE", "16"))
+ANALYSIS_CACHE_TTL = float(os.environ.get("ANALYSIS_CACHE_TTL", "600"))
+ANALYSIS_DISK_CACHE_DIR = os.environ.get("ANALYSIS_DISK_CACHE_DIR", os.path.join(UPLOAD_DIR, "analysis-cache"))
+ANALYSIS_DISK_CACHE_MB = float(os.environ.get("ANALYSIS_DISK_CACHE_MB", "1024"))
+analysis_cache = AnalysisCache(
+    # Settings that change what the analysis returns
+    extractor_version(FAST_READER, STREAMING_THRESHOLD_MB, STREAMING_PREVIEW_LIMIT),
+    maxsize=ANALYSIS_CACHE_SIZE,
+    ttl=ANALYSIS_CACHE_TTL,
+    directory=ANALYSIS_DISK_CACHE_DIR,
+    max_disk_bytes=int(ANALYSIS_DISK_CACHE_MB * 1024 * 1024)
+)
 
-class MeasurementResponse(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
 
-    file_id: str
-    filename: str
-    measurements: Measurements
+@app.on_event("startup")
+def requeue_interrupted_analyses():
+    # Analyses that were running when their server stopped are gone; those
+    # of other API processes sharing the database carry on
+    file_store.requeue_interrupted(process_alive)
 
 
-class GeometryEntity(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+@app.on_event("startup")
+def create_shared_results_dir():
+    global shared_results_dir
+    if SHARED_RESULTS:
+        parent = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        # Left behind by servers that crashed; the name holds the server's pid
+        for name in os.listdir(parent):
+            pid = name.split("-")[2] if name.startswith("dwg-results-") else ""
+            if pid.isdigit() and not process_alive(int(pid)):
+                release_directory(os.path.join(parent, name))
+        shared_results_dir = tempfile.mkdtemp(prefix=f"dwg-results-{os.getpid()}-", dir=parent)
 
-    type: str
-    layer: str
-    color: int
-    data: dict
 
+@app.on_event("shutdown")
+def shutdown_workers():
+    worker_pool.shutdown()
+    if shared_results_dir is not None:
+        # Results of workers that were still running
+        release_directory(shared_results_dir)
 
-class PreviewResponse(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
 
-    file_id: str
-    filename: str
-    bounding_box: BoundingBox
-    entities: List[GeometryEntity]
+def _analysis_results_dir() -> Optional[str]:
+    """A directory of its own for the results one analysis shares"""
+    return tempfile.mkdtemp(dir=shared_results_dir) if shared_results_dir is not None else None
 
 
 @app.get("/")
@@ -129,37 +174,35 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "memory_budget": memory_budget.stats(),
+        "analysis_cache": analysis_cache.stats()
+    }
 
 
 @app.post("/api/upload", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...)):
-    """Upload a DWG or DXF file"""
+async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """Upload a DWG or DXF file, optionally as .gz or single-entry .zip"""
     filename = file.filename
     if not filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
-    ext = os.path.splitext(filename)[1].lower()
-    if ext not in ['.dxf', '.dwg']:
-        raise HTTPException(status_code=400, detail="Only .dxf and .dwg files are supported")
+    try:
+        source, ext = open_drawing(file.file, filename, int(MAX_UPLOAD_MB * 1024 * 1024))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     file_id = str(uuid.uuid4())
-    safe_filename = f"{file_id}{ext}"
-    file_path = os.path.join(UPLOAD_DIR, safe_filename)
+    incoming_path = os.path.join(INCOMING_DIR, f"{file_id}{ext}")
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_size, sha256 = await run_in_threadpool(write_upload, source, incoming_path, COMPRESS_UPLOADS)
+        stored_path = await add_file(file_id, filename, ext, file_size, sha256, find_upload(incoming_path))
 
-        file_size = os.path.getsize(file_path)
-
-        file_storage[file_id] = FileInfo(
-            id=file_id,
-            filename=filename,
-            file_size=file_size,
-            upload_time=datetime.now(),
-            file_type=ext[1:].upper()
-        )
+        # Analyze right away so the dashboard GETs find the results ready
+        background_tasks.add_task(run_analysis_pipeline, file_id, stored_path, sha256)
 
         return UploadResponse(
             success=True,
@@ -169,446 +212,814 @@ async def upload_file(file: UploadFile = File(...)):
         )
 
     except Exception as e:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        incoming = find_upload(incoming_path)
+        if incoming is not None:
+            os.remove(incoming)
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=400, detail=str(e))
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+@app.post("/api/upload/by-hash", response_model=UploadResponse)
+async def upload_by_hash(request: HashUploadRequest, background_tasks: BackgroundTasks):
+    """Add a file whose content the server already holds, without its bytes.
 
-def convert_dwg_to_dxf(dwg_path: str) -> str:
-    """Convert DWG to DXF using ODA File Converter"""
-    import subprocess
-    import os
-
-    dxf_path = dwg_path.replace('.dwg', '.dxf')
-    # Check multiple possible locations for ODA File Converter
-    oda_path = os.environ.get('ODA_CONVERTER_PATH', '/tmp/oda/ODAFileConverter')
-
-    # Fallback locations
-    if not os.path.exists(oda_path):
-        for fallback in ['/tmp/oda/ODAFileConverter', '/opt/oda/ODAFileConverter', './ODAFileConverter']:
-            if os.path.exists(fallback):
-                oda_path = fallback
-                break
-
-    # Check if ODA converter exists
-    if not os.path.exists(oda_path):
-        # Try to find it in PATH
-        result = subprocess.run(['which', 'ODAFileConverter'], capture_output=True, text=True)
-        if result.returncode == 0:
-            oda_path = result.stdout.strip()
-        else:
-            raise Exception("ODA File Converter not found. Please install it or convert DWG to DXF manually.")
-
-    # ODAFileConverter syntax: "InputFolder" "OutputFolder" "ACAD2018" "ACAD2018" "DXF" "1" "1"
-    # Version "ACAD2018" = AutoCAD 2018 format
-    # Output type "DXF" = DXF format
-    # "1" "1" = recursive, audit
-    input_dir = os.path.dirname(dwg_path) or '.'
-    output_dir = input_dir
-    filename = os.path.basename(dwg_path)
-
-    cmd = [
-        oda_path,
-        input_dir,
-        output_dir,
-        "ACAD2018",  # Input version (auto-detect)
-        "ACAD2018",  # Output version
-        "DXF",       # Output format
-        "0",         # Recursive (0=no)
-        "1"          # Audit (1=yes)
-    ]
+    The client sends the SHA-256 of the drawing (uncompressed). If that
+    content is stored, a new file pointing to it is created, sharing its
+    analysis; otherwise the response is a 404 and the client uploads the
+    file with ``/api/upload``.
+    """
+    ext = os.path.splitext(request.filename.lower())[1]
+    if ext not in DRAWING_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Only .dxf and .dwg files are supported")
+    sha256 = request.sha256.lower()
 
+    file_id = str(uuid.uuid4())
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        if result.returncode != 0:
-            print(f"ODA conversion stderr: {result.stderr}")
-
-        # Check if output file was created
-        expected_dxf = os.path.splitext(dwg_path)[0] + '.dxf'
-        if os.path.exists(expected_dxf):
-            return expected_dxf
-        else:
-            raise Exception(f"Conversion failed. Output file not found: {expected_dxf}")
-    except subprocess.TimeoutExpired:
-        raise Exception("DWG conversion timed out")
-    except Exception as e:
-        raise Exception(f"DWG conversion failed: {e}")
+        stored_path = await add_file(file_id, request.filename, ext, None, sha256)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No file with this content is stored")
 
+    background_tasks.add_task(run_analysis_pipeline, file_id, stored_path, sha256)
 
-def parse_dxf_file(filepath: str):
-    """Parse a DXF/DWG file and return the document"""
-    import ezdxf
-    import os
+    return UploadResponse(
+        success=True,
+        file_id=file_id,
+        filename=request.filename,
+        message=f"File already stored, no upload needed. ID: {file_id}"
+    )
 
-    file_ext = os.path.splitext(filepath)[1].lower()
 
-    try:
-        if file_ext == '.dwg':
-            # DWG is a proprietary binary format that requires external conversion
-            # ezdxf can only read DXF (text-based) format natively
-            raise HTTPException(
-                status_code=400,
-                detail="DWG files require conversion to DXF. Please convert your file using:\n"
-                       "1. AutoCAD: SAVEAS → DXF format\n"
-                       "2. FreeCAD: File → Export → DXF (free)\n"
-                       "3. Online: anyconv.com, zamzar.com\n"
-                       "4. Or use the sample.dxf file from our GitHub repo"
-            )
-        else:
-            doc = ezdxf.readfile(filepath)
-            return doc
-    except Exception as e:
-        print(f"Error parsing file {filepath}: {e}")
-        return None
+def _session_path(session: UploadSession) -> str:
+    """The file a chunked upload is assembled in"""
+    ext = os.path.splitext(session.filename.lower())[1]
+    return os.path.join(INCOMING_DIR, session.upload_id + ext)
 
 
-def get_color_name(color_index: int) -> str:
-    """Get color name from AutoCAD color index"""
-    color_names = {
-        0: "ByBlock", 1: "Red", 2: "Yellow", 3: "Green", 4: "Cyan",
-        5: "Blue", 6: "Magenta", 7: "White/Black", 8: "Dark Gray",
-        9: "Light Gray", 10: "Light Red", 11: "Light Yellow",
-        12: "Light Green", 13: "Light Cyan", 14: "Light Blue",
-        15: "Light Magenta"
-    }
-    return color_names.get(color_index, f"Color {color_index}")
-
-
-def extract_layers(doc):
-    """Extract all layer information from the document"""
-    import math
-    layers = []
-    msp = doc.modelspace()
-
-    layer_entity_counts = {}
-    layer_line_lengths = {}
-    layer_closed_areas = {}
-
-    for entity in msp:
-        layer_name = entity.dxf.layer
-
-        if layer_name not in layer_entity_counts:
-            layer_entity_counts[layer_name] = 0
-            layer_line_lengths[layer_name] = 0.0
-            layer_closed_areas[layer_name] = 0.0
-
-        layer_entity_counts[layer_name] += 1
-
-        if entity.dxftype() == "LINE":
-            start = entity.dxf.start
-            end = entity.dxf.end
-            length = math.sqrt((end[0] - start[0])**2 + (end[1] - start[1])**2)
-            layer_line_lengths[layer_name] += length
-
-        elif entity.dxftype() == "LWPOLYLINE":
-            points = list(entity.get_points())
-            if len(points) > 1:
-                length = 0
-                area = 0
-                for i in range(len(points)):
-                    x1, y1 = points[i][0], points[i][1]
-                    x2, y2 = points[(i + 1) % len(points)][0], points[(i + 1) % len(points)][1]
-                    length += math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-                    area += (x1 * y2) - (x2 * y1)
-                layer_line_lengths[layer_name] += length
-                if entity.closed:
-                    layer_closed_areas[layer_name] += abs(area) / 2
-
-        elif entity.dxftype() == "HATCH":
-            try:
-                area = entity.total_area
-                layer_closed_areas[layer_name] += area
-            except:
-                pass
-
-    for layer in doc.layers:
-        name = layer.dxf.name
-        color = layer.dxf.color
-        visible = not layer.is_off()
-
-        layers.append(LayerInfo(
-            name=name,
-            color=color,
-            color_name=get_color_name(color),
-            visible=visible,
-            entity_count=layer_entity_counts.get(name, 0),
-            line_length=round(layer_line_lengths.get(name, 0.0), 4),
-            closed_area=round(layer_closed_areas.get(name, 0.0), 4)
-        ))
-
-    return layers
-
-
-def calculate_bounding_box(doc):
-    """Calculate the bounding box of all entities"""
-    from ezdxf import bbox
-    try:
-        extents = bbox.extents(doc.modelspace())
-        if extents:
-            min_x, min_y, min_z = extents.extmin
-            max_x, max_y, max_z = extents.extmax
-            return BoundingBox(
-                min_x=min_x, min_y=min_y, min_z=min_z,
-                max_x=max_x, max_y=max_y, max_z=max_z,
-                width=max_x - min_x,
-                height=max_y - min_y,
-                depth=max_z - min_z
-            )
-    except Exception as e:
-        print(f"Error calculating bounding box: {e}")
+def _expire_sessions():
+    """Remove chunked uploads started more than ``UPLOAD_SESSION_HOURS`` ago"""
+    for session in file_store.expired_sessions(datetime.now() - timedelta(hours=UPLOAD_SESSION_HOURS)):
+        if file_store.delete_session(session.upload_id) and os.path.exists(_session_path(session)):
+            os.remove(_session_path(session))
 
-    # Fallback
-    msp = doc.modelspace()
-    all_points = []
 
-    for entity in msp:
+@contextlib.asynccontextmanager
+async def _claim_range(upload_id: str, start: int, stop: int):
+    """Wait until no other request writes or commits ``[start, stop)`` of an upload"""
+    while True:
+        claims = upload_claims.setdefault(upload_id, [])
+        busy = [done for claim_start, claim_stop, done in claims
+                if claim_start < stop and claim_stop > start]
+        if not busy:
+            break
+        await asyncio.wait(busy)
+    claim = (start, stop, asyncio.get_running_loop().create_future())
+    claims.append(claim)
+    try:
+        yield
+    finally:
+        claims.remove(claim)
+        claim[2].set_result(None)
+        if not claims:
+            del upload_claims[upload_id]
+
+
+async def _get_session(upload_id: str) -> UploadSession:
+    session = await run_in_threadpool(file_store.get_session, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+@app.post("/api/uploads", response_model=UploadSession)
+async def start_upload(request: UploadInitRequest):
+    """Start a resumable upload of a drawing in chunks.
+
+    PUT the chunks to ``/api/uploads/{upload_id}?offset=``, in any order and
+    in parallel, each with its SHA-256 in ``X-Chunk-SHA256``; then POST to
+    ``/api/uploads/{upload_id}/commit``. After a dropped connection, GET
+    ``/api/uploads/{upload_id}`` lists the byte ranges received so far and
+    only the others need to be sent again. The chunks are written straight
+    into the final file, which is stored as is (uncompressed) on commit.
+    """
+    ext = os.path.splitext(request.filename.lower())[1]
+    if ext not in DRAWING_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Only .dxf and .dwg files are supported")
+    if request.size > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"File exceeds the maximum size of {MAX_UPLOAD_MB:g} MB")
+
+    await run_in_threadpool(_expire_sessions)
+    session = UploadSession(
+        upload_id=str(uuid.uuid4()),
+        filename=request.filename,
+        size=request.size,
+        sha256=request.sha256 and request.sha256.lower(),
+        created=datetime.now(),
+        chunk_size=int(UPLOAD_CHUNK_MB * 1024 * 1024),
+        complete=request.size == 0
+    )
+    await run_in_threadpool(allocate_upload, _session_path(session), session.size)
+    await run_in_threadpool(file_store.add_session, session)
+    return session
+
+
+@app.get("/api/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload(upload_id: str):
+    """Get a chunked upload and the byte ranges received so far"""
+    return await _get_session(upload_id)
+
+
+def _write_piece(fd: int, offset: int, data: bytes, digest):
+    write_at(fd, offset, data)
+    digest.update(data)
+
+
+@app.put("/api/uploads/{upload_id}", response_model=UploadSession)
+async def put_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0),
+                    chunk_sha256: Optional[str] = Header(None, alias="X-Chunk-SHA256")):
+    """Write a chunk (the raw request body) at ``offset`` of a chunked upload.
+
+    With ``X-Chunk-SHA256`` set, a chunk that doesn't match it is rejected
+    (400) and has to be sent again. Chunks overlapping one being written wait
+    for it, and chunks of a committed upload are rejected (404). Returns the
+    upload with the ranges received so far.
+    """
+    session = await _get_session(upload_id)
+    if offset > session.size:
+        raise HTTPException(status_code=400, detail="Offset is past the end of the file")
+    length = request.headers.get("content-length")
+    stop = offset + int(length) if length and length.isdigit() else session.size
+    if stop > session.size:
+        raise HTTPException(status_code=400, detail="Chunk goes past the end of the file")
+
+    async with _claim_range(upload_id, offset, stop):
+        # A commit may have finished while this chunk waited
+        session = await _get_session(upload_id)
         try:
-            if entity.dxftype() == "LINE":
-                all_points.append((entity.dxf.start[0], entity.dxf.start[1], 0))
-                all_points.append((entity.dxf.end[0], entity.dxf.end[1], 0))
-            elif hasattr(entity, 'get_points'):
-                for point in entity.get_points():
-                    all_points.append((point[0], point[1], 0))
-        except:
-            continue
+            fd = os.open(_session_path(session), os.O_WRONLY)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        digest = hashlib.sha256()
+        # Bytes up to ``end`` are written; up to ``dirty`` they may be
+        end = dirty = offset
+        try:
+            buffer = bytearray()
+            async for piece in request.stream():
+                buffer += piece
+                if end + len(buffer) > stop:
+                    raise HTTPException(status_code=400, detail="Chunk goes past the end of the file")
+                if len(buffer) >= COPY_CHUNK:
+                    dirty = end + len(buffer)
+                    await run_in_threadpool(_write_piece, fd, end, bytes(buffer), digest)
+                    end = dirty
+                    buffer.clear()
+            if buffer:
+                dirty = end + len(buffer)
+                await run_in_threadpool(_write_piece, fd, end, bytes(buffer), digest)
+                end = dirty
+                buffer.clear()
+            if chunk_sha256 is not None and digest.hexdigest() != chunk_sha256.lower():
+                raise HTTPException(status_code=400, detail="Chunk doesn't match its checksum; send it again")
+        except BaseException:
+            # Ranges received before may have been overwritten with bad data
+            if dirty > offset:
+                await run_in_threadpool(file_store.discard_chunks, upload_id, offset, dirty)
+            raise
+        finally:
+            os.close(fd)
+
+        if end > offset and not await run_in_threadpool(file_store.add_chunk, upload_id, offset, end):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return await _get_session(upload_id)
+
+
+@app.post("/api/uploads/{upload_id}/commit", response_model=UploadResponse)
+async def commit_upload(upload_id: str, background_tasks: BackgroundTasks):
+    """Finish a chunked upload once every byte has been received.
+
+    The file is hashed (and checked against the SHA-256 given when the
+    upload started) and stored like a regular upload. Chunks still being
+    written are waited for.
+    """
+    session = await _get_session(upload_id)
+    async with _claim_range(upload_id, 0, session.size):
+        session = await _get_session(upload_id)
+        if not session.complete:
+            raise HTTPException(status_code=409, detail="Not all chunks have been received")
+
+        path = _session_path(session)
+        sha256 = await run_in_threadpool(content_hash, path)
+        if session.sha256 is not None and sha256 != session.sha256:
+            await abort_upload(upload_id)
+            raise HTTPException(status_code=400, detail="Uploaded file doesn't match its checksum")
+        # Only one of concurrent commits goes on
+        if not await run_in_threadpool(file_store.delete_session, upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
 
-    if all_points:
-        min_x = min(p[0] for p in all_points)
-        max_x = max(p[0] for p in all_points)
-        min_y = min(p[1] for p in all_points)
-        max_y = max(p[1] for p in all_points)
-        min_z = min(p[2] for p in all_points)
-        max_z = max(p[2] for p in all_points)
-
-        return BoundingBox(
-            min_x=min_x, min_y=min_y, min_z=min_z,
-            max_x=max_x, max_y=max_y, max_z=max_z,
-            width=max_x - min_x,
-            height=max_y - min_y,
-            depth=max_z - min_z
-        )
+    file_id = str(uuid.uuid4())
+    ext = os.path.splitext(session.filename.lower())[1]
+    try:
+        stored_path = await add_file(file_id, session.filename, ext, session.size, sha256, path)
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-    return BoundingBox(min_x=0, min_y=0, min_z=0, max_x=0, max_y=0, max_z=0, width=0, height=0, depth=0)
-
-
-def extract_measurements(doc):
-    """Extract all measurements from the document"""
-    msp = doc.modelspace()
-    total_entities = len(list(msp))
-
-    bounding_box = calculate_bounding_box(doc)
-
-    layers = extract_layers(doc)
-    total_line_length = sum(layer.line_length for layer in layers)
-    total_closed_area = sum(layer.closed_area for layer in layers)
-
-    dimensions = []
-    for entity in msp:
-        if entity.dxftype() == "DIMENSION":
-            try:
-                dim_data = {
-                    "type": entity.dxftype(),
-                    "layer": entity.dxf.layer,
-                    "text": entity.get_text(),
-                    "actual_measurement": entity.get_actual_measurement(),
-                    "dimstyle": entity.dxf.dimstyle,
-                }
-                if hasattr(entity.dxf, 'defpoint'):
-                    dim_data["defpoint"] = entity.dxf.defpoint
-                if hasattr(entity.dxf, 'text_midpoint'):
-                    dim_data["text_midpoint"] = entity.dxf.text_midpoint
-                dimensions.append(dim_data)
-            except Exception as e:
-                print(f"Error extracting dimension: {e}")
-
-    return Measurements(
-        total_entities=total_entities,
-        bounding_box=bounding_box,
-        total_line_length=round(total_line_length, 4),
-        total_closed_area=round(total_closed_area, 4),
-        dimensions=dimensions
+    background_tasks.add_task(run_analysis_pipeline, file_id, stored_path, sha256)
+
+    return UploadResponse(
+        success=True,
+        file_id=file_id,
+        filename=session.filename,
+        message=f"File uploaded successfully. ID: {file_id}"
     )
 
 
-def extract_preview_geometry(doc):
-    """Extract geometry data for 2D preview"""
-    msp = doc.modelspace()
-    entities = []
+@app.delete("/api/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """Abandon a chunked upload"""
+    session = await _get_session(upload_id)
+    if await run_in_threadpool(file_store.delete_session, upload_id):
+        path = _session_path(session)
+        if os.path.exists(path):
+            os.remove(path)
+    return {"success": True, "message": "Upload abandoned"}
+
+
+async def add_file(file_id: str, filename: str, ext: str, file_size: Optional[int], sha256: str,
+                   upload: Optional[str] = None) -> str:
+    """Add a file with the content ``sha256`` and return its stored path.
+
+    ``upload`` is moved into blob storage unless the content is stored
+    already. Without ``upload`` the content must be stored already, and
+    ``file_size`` may be None; ``FileNotFoundError`` is raised if it isn't.
+    A file with the same content that has been analyzed passes on its
+    status and loader, since the two share the analysis.
+    """
+    path = blob_path(BLOB_DIR, sha256, ext)
+    same = await run_in_threadpool(file_store.find_content, sha256)
+    if file_size is None:
+        if same is None:
+            raise FileNotFoundError(sha256)
+        file_size = same.file_size
+    info = FileInfo(
+        id=file_id,
+        filename=filename,
+        file_size=file_size,
+        upload_time=datetime.now(),
+        file_type=ext[1:].upper(),
+        sha256=sha256
+    )
+    if same is not None and same.status == "ready":
+        info.status, info.loader, info.fixes = same.status, same.loader, same.fixes
+
+    def store():
+        if upload is not None:
+            store_blob(upload, path)
+        # Checked in the transaction, so that a delete can't remove it meanwhile
+        elif find_upload(path) is None:
+            raise FileNotFoundError(path)
+
+    await run_in_threadpool(file_store.add, info, store)
+    return find_upload(path)
+
+
+def _adopt_upload(file_info: FileInfo, legacy_path: str):
+    """Move a file stored under its id, from before uploads were stored by
+    content, into blob storage"""
+    if file_info.sha256 is None:
+        file_info.sha256 = content_hash(legacy_path)
+    path = blob_path(BLOB_DIR, file_info.sha256, f".{file_info.file_type.lower()}")
+
+    def store():
+        if not os.path.exists(legacy_path):
+            return False
+        store_blob(legacy_path, path)
+        if os.path.exists(binary_copy_path(legacy_path)):
+            os.remove(binary_copy_path(legacy_path))
+        return True
+
+    file_store.adopt(file_info.id, file_info.sha256, store)
+
+
+def _remove_content(file_info: FileInfo):
+    """Remove a deleted file's stored content and its binary DXF copy"""
+    ext = f".{file_info.file_type.lower()}"
+    paths = [os.path.join(UPLOAD_DIR, file_info.id + ext)]
+    if file_info.sha256 is not None:
+        paths.append(blob_path(BLOB_DIR, file_info.sha256, ext))
+    for path in paths:
+        for stored in (find_upload(path), binary_copy_path(path)):
+            if stored is not None and os.path.exists(stored):
+                os.remove(stored)
+
+
+async def _set_status(file_id: str, status: str, error: Optional[str] = None):
+    await run_in_threadpool(file_store.update, file_id, status=status, error=error)
+
+
+async def run_analysis(filepath: str, loader: Optional[str] = None,
+                       progress: Optional[AnalysisProgress] = None):
+    """Analyze a file in the worker pool once it fits in the memory budget.
+
+    ``loader`` is the ezdxf loader that worked for this file before; files
+    that needed recover mode go straight to it. ``progress`` follows the
+    chunks merged so far when the file is analyzed in chunks.
+    """
+    streaming_threshold = int(STREAMING_THRESHOLD_MB * 1024 * 1024)
+    # The pre-scan reads the whole file, so it runs in a worker rather than
+    # holding the GIL in the API process
+    mode, estimate = await worker_pool.run(
+        estimate_analysis, filepath, FAST_READER, streaming_threshold, loader, BINARY_DXF_COPY
+    )
+    async with memory_budget.reserve(estimate):
+        result = await _run_in_workers(filepath, loader, progress, mode)
+
+    if result is not None:
+        result["metadata"]["estimated_mb"] = estimate
+    return result
+
+
+async def _run_in_workers(filepath: str, loader: Optional[str] = None,
+                          progress: Optional[AnalysisProgress] = None,
+                          mode: Optional[str] = None):
+    """Analyze a file in the worker pool, splitting large files into chunks.
+
+    ``mode`` is the one the pre-scan predicted, if any. When it's another
+    than ``fast``, the tag-level reader isn't going to handle the file, so
+    neither the chunk scans nor the serial fast attempt are tried.
+    """
+    file_size = upload_size(filepath)
+    streaming_threshold = int(STREAMING_THRESHOLD_MB * 1024 * 1024)
+    fast_reader = FAST_READER and mode in (None, "fast")
+
+    if (fast_reader and loader != "recover"
+            and original_path(filepath).lower().endswith(".dxf")
+            and file_size > PARALLEL_THRESHOLD_MB * 1024 * 1024):
+        large = streaming_threshold and file_size > streaming_threshold
+        # At least one chunk per worker, and small enough chunks that
+        # partial results show up early
+        chunks = max(PARSE_WORKERS, math.ceil(file_size / (PARALLEL_CHUNK_MB * 1024 * 1024)))
+        # The chunk workers map the file, so they need it uncompressed
+        plain_path = filepath
+        if is_compressed(filepath):
+            plain_path = await run_in_threadpool(decompressed_copy, filepath)
+        share_dir = _analysis_results_dir()
+        try:
+            result = await parallel_analyze(
+                worker_pool, plain_path, chunks, STREAMING_PREVIEW_LIMIT if large else None, progress,
+                share_dir
+            )
+        finally:
+            if plain_path != filepath:
+                os.remove(plain_path)
+            if share_dir is not None:
+                release_directory(share_dir)
+        if result is not None:
+            return result
+
+    # Removed whatever happens to the analysis: attached results are
+    # already unlinked, and those of workers that were cancelled, timed
+    # out or died are gone once the worker is done
+    share_dir = _analysis_results_dir()
+    abandoned = partial(release_directory, share_dir) if share_dir is not None else None
+    try:
+        result = await worker_pool.run(
+            analyze_file,
+            filepath,
+            streaming_threshold,
+            STREAMING_PREVIEW_LIMIT,
+            fast_reader,
+            loader,
+            BINARY_DXF_COPY,
+            share_dir,
+            abandoned=abandoned
+        )
+        if result is not None:
+            result["preview"]["entities"] = attach(result["preview"]["entities"])
+    finally:
+        if share_dir is not None:
+            release_directory(share_dir)
+    return result
 
-    bounding_box = calculate_bounding_box(doc)
 
-    for entity in msp:
-        entity_type = entity.dxftype()
-        layer = entity.dxf.layer
-        color = entity.dxf.color if hasattr(entity.dxf, 'color') else 7
+async def _analyze(file_id: str, filepath: str, progress: AnalysisProgress):
+    file_info = await run_in_threadpool(file_store.get, file_id)
+    await _set_status(file_id, "processing")
+    try:
+        return await run_analysis(filepath, file_info.loader if file_info else None, progress)
+    except asyncio.CancelledError:
+        # Every client waiting for it went away; the next request starts over
+        await _set_status(file_id, "queued")
+        raise
+    except Exception as e:
+        await _set_status(file_id, "failed", str(e) or type(e).__name__)
+        raise
 
-        geom_data = {"type": entity_type, "layer": layer, "color": color, "data": {}}
 
+async def _analyze_and_cache(file_id: str, filepath: str, sha256: str):
+    key = analysis_cache.key(sha256)
+    # Partial results stay available until the whole result is cached
+    progress = analysis_progress[key] = AnalysisProgress()
+    try:
+        return await _cache_analysis(file_id, filepath, sha256, key, progress)
+    finally:
+        if analysis_progress.get(key) is progress:
+            del analysis_progress[key]
+
+
+async def _cache_analysis(file_id: str, filepath: str, sha256: str, key: str,
+                          progress: AnalysisProgress):
+    result = await run_in_threadpool(analysis_cache.load, key)
+    fresh = result is None
+    if fresh:
+        result = await _analyze(file_id, filepath, progress)
+
+    if result is None:
+        await _set_status(file_id, "failed", "Failed to parse file")
+    # Don't resurrect an entry for content deleted while it was being analyzed
+    elif await run_in_threadpool(file_store.find_content, sha256) is not None:
+        metadata = result["metadata"]
+        fields = {"status": "ready", "error": None}
+        if metadata.get("loader"):
+            fields.update(loader=metadata["loader"], fixes=metadata["fixes"])
+        await run_in_threadpool(analysis_cache.set, key, result, fresh)
+        # Every file with this content shares the analysis
+        await run_in_threadpool(file_store.update_content, sha256, **fields)
+    elif not os.path.exists(filepath) and os.path.exists(binary_copy_path(filepath)):
+        os.remove(binary_copy_path(filepath))
+    return result
+
+
+async def get_analysis(file_id: str, filepath: str, sha256: str, hold: bool = True):
+    """Return the analysis result for a file, analyzing it only on a cache miss.
+
+    Files with the same content (``sha256``) share the analysis. It is
+    cancelled once every caller holding it has been cancelled, unless it was
+    kept with ``inflight.keep``. With ``hold`` unset the caller only waits
+    for it and gets ``WorkAbandoned`` if it is cancelled that way.
+    """
+    key = analysis_cache.key(sha256)
+    while True:
+        result = analysis_cache.get(key)
+        if result is not None:
+            return result
         try:
-            if entity_type == "LINE":
-                geom_data["data"] = {
-                    "start": [entity.dxf.start[0], entity.dxf.start[1]],
-                    "end": [entity.dxf.end[0], entity.dxf.end[1]]
-                }
-                entities.append(GeometryEntity.model_validate(geom_data))
-
-            elif entity_type == "LWPOLYLINE":
-                points = [[p[0], p[1]] for p in entity.get_points()]
-                geom_data["data"] = {
-                    "points": points,
-                    "closed": entity.closed
-                }
-                entities.append(GeometryEntity.model_validate(geom_data))
-
-            elif entity_type == "CIRCLE":
-                geom_data["data"] = {
-                    "center": [entity.dxf.center[0], entity.dxf.center[1]],
-                    "radius": entity.dxf.radius
-                }
-                entities.append(GeometryEntity.model_validate(geom_data))
-
-            elif entity_type == "ARC":
-                geom_data["data"] = {
-                    "center": [entity.dxf.center[0], entity.dxf.center[1]],
-                    "radius": entity.dxf.radius,
-                    "start_angle": entity.dxf.start_angle,
-                    "end_angle": entity.dxf.end_angle
-                }
-                entities.append(GeometryEntity.model_validate(geom_data))
-
-            elif entity_type == "TEXT":
-                geom_data["data"] = {
-                    "position": [entity.dxf.insert[0], entity.dxf.insert[1]],
-                    "text": entity.dxf.text,
-                    "height": entity.dxf.height,
-                    "rotation": entity.dxf.rotation if hasattr(entity.dxf, 'rotation') else 0
-                }
-                entities.append(GeometryEntity.model_validate(geom_data))
-
-            elif entity_type == "MTEXT":
-                geom_data["data"] = {
-                    "position": [entity.dxf.insert[0], entity.dxf.insert[1]],
-                    "text": entity.text,
-                    "height": entity.dxf.char_height,
-                    "rotation": entity.dxf.rotation if hasattr(entity.dxf, 'rotation') else 0
-                }
-                entities.append(GeometryEntity.model_validate(geom_data))
-
-        except Exception as e:
-            print(f"Error processing entity {entity_type}: {e}")
+            return await inflight.do(
+                ("analyze", key),
+                lambda: _analyze_and_cache(file_id, filepath, sha256),
+                hold
+            )
+        except WorkAbandoned:
+            if not hold:
+                raise
+            # Cancelled as this caller joined it; start it again
             continue
 
-    return bounding_box, entities
 
+async def run_analysis_pipeline(file_id: str, filepath: str, sha256: str):
+    """Analyze a freshly uploaded file in the background.
 
-@app.get("/api/files/{file_id}/layers", response_model=LayerResponse)
-async def get_layers(file_id: str):
-    """Get layer information for a file"""
-    if file_id not in file_storage:
+    The pipeline doesn't hold the analysis: it runs until it is done while
+    no client asks for it, and is cancelled once clients have and all of
+    them went away.
+    """
+    try:
+        await get_analysis(file_id, filepath, sha256, hold=False)
+    except WorkAbandoned:
+        pass  # the file is queued again; the next request starts over
+    except Exception as e:
+        print(f"Background analysis of {file_id} failed: {e}")
+
+
+async def locate_file(file_id: str):
+    """Return a file's metadata and path on disk, or raise a 404.
+
+    Files uploaded before uploads were stored by content are moved into
+    blob storage here.
+    """
+    file_info = await run_in_threadpool(file_store.get, file_id)
+    if file_info is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    file_info = file_storage[file_id]
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.{file_info.file_type.lower()}")
+    ext = f".{file_info.file_type.lower()}"
+    legacy_path = find_upload(os.path.join(UPLOAD_DIR, file_id + ext))
+    if legacy_path is not None:
+        await run_in_threadpool(_adopt_upload, file_info, legacy_path)
 
-    if not os.path.exists(file_path):
+    file_path = None
+    if file_info.sha256 is not None:
+        file_path = find_upload(blob_path(BLOB_DIR, file_info.sha256, ext))
+
+    if file_path is None:
         raise HTTPException(status_code=404, detail="File data not found on disk")
 
-    try:
-        doc = parse_dxf_file(file_path)
-        if not doc:
-            raise HTTPException(status_code=400, detail="Failed to parse file")
+    return file_info, file_path
 
-        layers = extract_layers(doc)
 
-        return LayerResponse(
-            file_id=file_id,
-            filename=file_info.filename,
-            layers=layers
-        )
+def analysis_available(file_info: FileInfo) -> bool:
+    """Whether a file's analysis can be had without analyzing it"""
+    return analysis_cache.key(file_info.sha256) in analysis_cache
+
 
+async def _client_disconnected(request: Request):
+    """Return once the client has closed the connection"""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def unless_disconnected(request: Request, awaitable):
+    """Await ``awaitable``, cancelling it if the client goes away first"""
+    work = asyncio.ensure_future(awaitable)
+    disconnected = asyncio.ensure_future(_client_disconnected(request))
+    try:
+        await asyncio.wait((work, disconnected), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+        if not work.done():
+            work.cancel()
+    if work.cancelled():
+        # Nobody will read the response
+        raise HTTPException(status_code=499, detail="Client closed request")
+    return work.result()
+
+
+async def _until_deadline(key: str, work: asyncio.Future, timeout: float):
+    """Await ``work``; once ``timeout`` passes, keep the analysis going and
+    raise ``asyncio.TimeoutError``"""
+    try:
+        done, _ = await asyncio.wait((work,), timeout=timeout)
+        if not done:
+            # Kept before this waiter lets go of it
+            inflight.keep(("analyze", key))
+            raise asyncio.TimeoutError()
+        return work.result()
+    finally:
+        if not work.done():
+            work.cancel()
+
+
+async def load_analysis(file_id: str, request: Optional[Request] = None,
+                        deadline_ms: Optional[int] = None, preview_from: Optional[int] = None):
+    """Look up a file and return its metadata and analysis, or raise an HTTP error.
+
+    If the client of ``request`` disconnects first, the analysis is
+    cancelled unless other requests are still waiting for it. With
+    ``deadline_ms`` set, the analysis carries on in the background once the
+    deadline passes and the results of the chunks merged so far are
+    returned instead, with ``complete`` set to False; their preview only
+    holds up to ``DEADLINE_PREVIEW_LIMIT`` entities from the
+    ``preview_from``-th on (see ``AnalysisProgress.snapshot``).
+    """
+    file_info, file_path = await locate_file(file_id)
+    key = analysis_cache.key(file_info.sha256)
+
+    pending = get_analysis(file_id, file_path, file_info.sha256)
+    if deadline_ms is not None and not analysis_available(file_info):
+        pending = _until_deadline(key, asyncio.ensure_future(pending), max(0, deadline_ms) / 1000)
+    try:
+        analysis = await (pending if request is None else unless_disconnected(request, pending))
+    except asyncio.TimeoutError:
+        # It may have finished since the deadline passed
+        analysis = analysis_cache.get(key)
+        if analysis is not None:
+            return file_info, analysis
+        # The analysis carries on; the client will be back for the rest
+        progress = analysis_progress.get(key) or AnalysisProgress()
+        analysis = await run_in_threadpool(
+            progress.snapshot, preview_from, DEADLINE_PREVIEW_LIMIT or None, SNAPSHOT_WAIT_S
+        )
+        analysis["complete"] = False
+        return file_info, analysis
+    except HTTPException:
+        raise
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=f"Error processing file: {str(e)}")
+    except AnalysisOutOfMemory as e:
+        raise HTTPException(status_code=413, detail=f"File too large to process: {str(e)}")
+    except WorkerCrashed as e:
+        raise HTTPException(status_code=422, detail=f"Error processing file: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+    if not analysis:
+        raise HTTPException(status_code=400, detail="Failed to parse file")
 
-@app.get("/api/files/{file_id}/measurements", response_model=MeasurementResponse)
-async def get_measurements(file_id: str):
-    """Get measurements for a file"""
-    if file_id not in file_storage:
-        raise HTTPException(status_code=404, detail="File not found")
+    return file_info, analysis
 
-    file_info = file_storage[file_id]
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.{file_info.file_type.lower()}")
 
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File data not found on disk")
+async def load_approximation(file_id: str, background_tasks: BackgroundTasks):
+    """Estimate a file's statistics from a sample of its entities, taken in the worker pool.
 
+    Returns the file's metadata and the estimate, or None if the exact
+    analysis is available (cached in memory or on disk) or the file can't be
+    sampled. The exact analysis is run in the background after the response.
+    """
+    file_info, file_path = await locate_file(file_id)
+    if analysis_available(file_info):
+        return None
     try:
-        doc = parse_dxf_file(file_path)
-        if not doc:
-            raise HTTPException(status_code=400, detail="Failed to parse file")
+        analysis = await worker_pool.run(approx_analyze, file_path, int(APPROX_SAMPLE_MB * 1024 * 1024))
+    except (AnalysisTimeout, AnalysisOutOfMemory, WorkerCrashed) as e:
+        print(f"Could not sample {file_path}: {e}")
+        analysis = None
+    if analysis is None:
+        return None
+    background_tasks.add_task(run_analysis_pipeline, file_id, file_path, file_info.sha256)
+    return file_info, analysis
 
-        measurements = extract_measurements(doc)
 
-        return MeasurementResponse(
-            file_id=file_id,
-            filename=file_info.filename,
-            measurements=measurements
-        )
+@app.get("/api/files/{file_id}/layers", response_model=LayerResponse)
+async def get_layers(file_id: str, request: Request, background_tasks: BackgroundTasks,
+                     quick: bool = False, mode: Literal["exact", "approx"] = "exact"):
+    """Get layer information for a file.
+
+    With ``quick`` set and no analysis available yet, only the LAYER table is
+    read and the layers are returned straight away without entity statistics
+    (``complete`` is false); the full analysis carries on in the background.
+    With ``mode=approx`` and no analysis available yet, the statistics are
+    estimated from a sample of the entities, with 95% confidence intervals
+    (``complete`` is false); the exact analysis runs in the background.
+    """
+    if mode == "approx":
+        approximation = await load_approximation(file_id, background_tasks)
+        if approximation is not None:
+            file_info, analysis = approximation
+            return LayerResponse(
+                file_id=file_id,
+                filename=file_info.filename,
+                layers=analysis["layers"],
+                complete=False,
+                metadata=analysis["metadata"]
+            )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    file_info, file_path = await locate_file(file_id)
+    if quick and not analysis_available(file_info):
+        layers = await run_in_threadpool(quick_layers, file_path)
+        if layers is not None:
+            return LayerResponse(
+                file_id=file_id,
+                filename=file_info.filename,
+                layers=layers,
+                complete=False
+            )
 
+    file_info, analysis = await load_analysis(file_id, request)
 
-@app.get("/api/files/{file_id}/preview", response_model=PreviewResponse)
-async def get_preview(file_id: str):
-    """Get preview geometry data for a file"""
-    if file_id not in file_storage:
-        raise HTTPException(status_code=404, detail="File not found")
+    return LayerResponse(
+        file_id=file_id,
+        filename=file_info.filename,
+        layers=analysis["layers"],
+        metadata=analysis["metadata"]
+    )
 
-    file_info = file_storage[file_id]
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.{file_info.file_type.lower()}")
 
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File data not found on disk")
+def _continuation_offset(continuation: Optional[str]) -> int:
+    """Number of preview entities a client already has, from its continuation token"""
+    if continuation is None:
+        return 0
+    if not continuation.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid continuation token")
+    return int(continuation)
 
-    try:
-        doc = parse_dxf_file(file_path)
-        if not doc:
-            raise HTTPException(status_code=400, detail="Failed to parse file")
 
-        bbox, entities = extract_preview_geometry(doc)
+def _continuation_token(analysis: dict) -> Optional[str]:
+    """Token for picking up a partial analysis where it left off"""
+    if analysis.get("complete", True):
+        return None
+    preview = analysis["preview"]
+    return str(preview.get("start", 0) + len(preview["entities"]))
 
-        return PreviewResponse(
-            file_id=file_id,
-            filename=file_info.filename,
-            bounding_box=bbox,
-            entities=entities
+
+@app.get("/api/files/{file_id}/measurements", response_model=MeasurementResponse)
+async def get_measurements(file_id: str, request: Request, background_tasks: BackgroundTasks,
+                           deadline_ms: Optional[int] = None,
+                           mode: Literal["exact", "approx"] = "exact"):
+    """Get measurements for a file.
+
+    With ``deadline_ms`` set and the analysis still running when it passes,
+    the totals of the entities scanned so far are returned with ``complete``
+    false and a ``continuation`` token; call again for the rest. With
+    ``mode=approx`` and no analysis available yet, the totals are estimated
+    from a sample of the entities, with 95% confidence intervals
+    (``complete`` is false); the exact analysis runs in the background.
+    The bounding box then only covers the sampled entities.
+    """
+    if mode == "approx":
+        approximation = await load_approximation(file_id, background_tasks)
+        if approximation is not None:
+            file_info, analysis = approximation
+            return MeasurementResponse(
+                file_id=file_id,
+                filename=file_info.filename,
+                measurements=analysis["measurements"],
+                complete=False,
+                metadata=analysis["metadata"]
+            )
+
+    file_info, analysis = await load_analysis(file_id, request, deadline_ms)
+
+    return MeasurementResponse(
+        file_id=file_id,
+        filename=file_info.filename,
+        measurements=analysis["measurements"],
+        complete=analysis.get("complete", True),
+        continuation=_continuation_token(analysis),
+        metadata=analysis.get("metadata")
+    )
+
+
+@app.get("/api/files/{file_id}/preview", response_model=PreviewResponse)
+async def get_preview(file_id: str, request: Request, deadline_ms: Optional[int] = None,
+                      continuation: Optional[str] = None):
+    """Get preview geometry data for a file.
+
+    With ``deadline_ms`` set and the analysis still running when it passes,
+    the entities extracted so far are returned with ``complete`` false and a
+    ``continuation`` token. Passing the token back returns only the entities
+    after those already sent. A response to a request with a deadline holds
+    at most ``DEADLINE_PREVIEW_LIMIT`` entities; if more remain, it is
+    incomplete as well.
+
+    The entities are serialized straight from the analysis' ``GeometryStore``
+    rather than validated one model at a time; the response still has the
+    ``PreviewResponse`` shape.
+    """
+    offset = _continuation_offset(continuation)
+    file_info, analysis = await load_analysis(file_id, request, deadline_ms, offset)
+    metadata = analysis.get("metadata")
+    # Partial results only hold the entities from ``start`` on
+    preview = analysis["preview"]
+    store = preview["entities"][offset - preview.get("start", 0):]
+    complete = analysis.get("complete", True)
+    if deadline_ms is not None and DEADLINE_PREVIEW_LIMIT and len(store) > DEADLINE_PREVIEW_LIMIT:
+        # The rest comes with the next call
+        store = store[:DEADLINE_PREVIEW_LIMIT]
+        complete = False
+    entities = await run_in_threadpool(store.to_dicts)
+
+    return JSONResponse({
+        "file_id": file_id,
+        "filename": file_info.filename,
+        "bounding_box": analysis["preview"]["bounding_box"],
+        "entities": entities,
+        "complete": complete,
+        "continuation": None if complete else str(offset + len(store)),
+        "metadata": None if metadata is None else AnalysisMetadata.model_validate(metadata).model_dump(),
+    })
+
+
+@app.get("/api/files", response_model=FileListResponse)
+async def list_files(limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None,
+                     sort: Literal["upload_time", "file_size"] = "upload_time",
+                     order: Literal["asc", "desc"] = "desc",
+                     file_type: Optional[str] = Query(None, alias="type")):
+    """List uploaded files a page at a time.
+
+    Files are sorted by ``sort`` (newest or largest first by default) and
+    can be filtered by ``type`` (``DXF`` or ``DWG``). Pass the returned
+    ``next_cursor`` as ``cursor`` with the same sort to get the next page;
+    it is null on the last page.
+    """
+    try:
+        files, next_cursor = await run_in_threadpool(
+            file_store.list, sort, order == "desc", file_type and file_type.upper(), limit, cursor
         )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FileListResponse(files=files, next_cursor=next_cursor)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+@app.get("/api/files/{file_id}", response_model=FileInfo)
+async def get_file(file_id: str):
+    """Get metadata and analysis status for a file"""
+    file_info = await run_in_threadpool(file_store.get, file_id)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail="File not found")
 
-@app.get("/api/files")
-async def list_files():
-    """List all uploaded files"""
-    return {"files": list(file_storage.values())}
+    return file_info
 
 
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str):
-    """Delete a file and its metadata"""
-    if file_id not in file_storage:
-        raise HTTPException(status_code=404, detail="File not found")
+    """Delete a file and its metadata.
 
-    file_info = file_storage[file_id]
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.{file_info.file_type.lower()}")
-
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    The stored drawing is removed with the last file referencing it. Its
+    cached analysis is kept: the same content may be uploaded again.
+    """
+    file_info = await run_in_threadpool(file_store.get, file_id)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    legacy_path = find_upload(os.path.join(UPLOAD_DIR, f"{file_id}.{file_info.file_type.lower()}"))
+    if legacy_path is not None and file_info.sha256 is not None:
+        # Count its reference to the content before dropping it
+        await run_in_threadpool(_adopt_upload, file_info, legacy_path)
 
-    del file_storage[file_id]
+    # Deleted first, so that a running analysis doesn't store its results
+    if await run_in_threadpool(file_store.delete, file_id, _remove_content) is None:
+        raise HTTPException(status_code=404, detail="File not found")
 
     return {"success": True, "message": "File deleted successfully"}
 
@@ -0,0 +1,176 @@
+"""Pydantic schemas for the DWG Dashboard API"""
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
+from datetime import datetime
+
+
+class LayerInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    name: str
+    color: int
+    color_name: str
+    visible: bool
+    entity_count: int
+    line_length: float
+    closed_area: float = 0.0
+    # 95% confidence intervals of approximate (sampled) figures
+    entity_count_ci: Optional[List[float]] = None
+    line_length_ci: Optional[List[float]] = None
+    closed_area_ci: Optional[List[float]] = None
+
+
+class BoundingBox(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    min_x: float
+    min_y: float
+    min_z: float
+    max_x: float
+    max_y: float
+    max_z: float
+    width: float
+    height: float
+    depth: float
+
+
+class Measurements(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    total_entities: int
+    bounding_box: BoundingBox
+    total_line_length: float
+    total_closed_area: float
+    dimensions: List[dict]
+    # 95% confidence intervals of approximate (sampled) figures
+    total_entities_ci: Optional[List[float]] = None
+    total_line_length_ci: Optional[List[float]] = None
+    total_closed_area_ci: Optional[List[float]] = None
+
+
+class FileInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    filename: str
+    file_size: int
+    upload_time: datetime
+    file_type: str
+    # Background analysis state: queued, processing, ready or failed
+    status: str = "queued"
+    error: Optional[str] = None
+    # ezdxf loader that parsed the file (reused by later analyses) and the
+    # auditor's repairs if it had to be recovered
+    loader: Optional[str] = None
+    fixes: List[str] = []
+    # SHA-256 of the drawing's (uncompressed) content
+    sha256: Optional[str] = None
+
+
+class FileListResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    files: List[FileInfo]
+    # Pass back as ``cursor`` for the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class HashUploadRequest(BaseModel):
+    # Name of the drawing (.dxf or .dwg) and SHA-256 of its content, in hex
+    filename: str
+    sha256: str = Field(pattern=r"^[0-9a-fA-F]{64}$")
+
+
+class UploadInitRequest(BaseModel):
+    # Name and size of the drawing (.dxf or .dwg) to upload in chunks, and
+    # optionally the SHA-256 of the whole file, checked on commit
+    filename: str
+    size: int = Field(ge=0)
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-fA-F]{64}$")
+
+
+class UploadSession(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    upload_id: str
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+    created: datetime
+    # Suggested size of the chunks to PUT
+    chunk_size: int
+    # Byte ranges received so far, as sorted, merged [start, end) pairs
+    received: List[List[int]] = []
+    complete: bool = False
+
+
+class UploadResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    success: bool
+    file_id: str
+    filename: str
+    message: str
+
+
+class AnalysisMetadata(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    mode: str
+    duration_ms: float
+    peak_rss_mb: float
+    # ezdxf loader used by a full parse ("strict" or "recover") and the
+    # repairs the auditor made in recover mode
+    loader: Optional[str] = None
+    fixes: List[str] = []
+    # Predicted peak memory above the worker's baseline, used for admission
+    estimated_mb: Optional[float] = None
+    # Share of the ENTITIES section scanned by an approximate analysis
+    sample_fraction: Optional[float] = None
+
+
+class LayerResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    file_id: str
+    filename: str
+    layers: List[LayerInfo]
+    # False when only the layer table was read and entity statistics are missing
+    complete: bool = True
+    metadata: Optional[AnalysisMetadata] = None
+
+
+class MeasurementResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    file_id: str
+    filename: str
+    measurements: Measurements
+    # False when the deadline passed first and only part of the file is counted
+    complete: bool = True
+    # Pass back as ``continuation`` to the preview to get the remaining entities
+    continuation: Optional[str] = None
+    metadata: Optional[AnalysisMetadata] = None
+
+
+class GeometryEntity(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    type: str
+    layer: str
+    color: int
+    data: dict
+
+
+class PreviewResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    file_id: str
+    filename: str
+    bounding_box: BoundingBox
+    entities: List[GeometryEntity]
+    # False when the deadline passed first and more entities will follow
+    complete: bool = True
+    # Pass back as ``continuation`` to get only the entities after these
+    continuation: Optional[str] = None
+    metadata: Optional[AnalysisMetadata] = None
@@ -0,0 +1,220 @@
+"""Parallel analysis of the ENTITIES section across worker processes.
+
+A single parse only uses one core, but the ENTITIES section is a flat list of
+independent records. ``plan_chunks`` finds its byte range and cuts it into
+pieces at entity boundaries (``0`` group codes), each worker scans one piece
+with the tag-level reader and the partial totals are merged in file order.
+Chunks record every length/area contribution instead of a partial sum, so
+the merged totals are bit-for-bit those of a serial scan.
+
+Chunks are merged as soon as all chunks before them are done, and
+``AnalysisProgress`` lets requests read the totals merged so far while the
+rest of the file is still being scanned.
+"""
+import asyncio
+import mmap
+import re
+import threading
+import time
+from functools import partial
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .geometry import attach, release, release_directory, share
+from .tagreader import EntityTotals, build_result, find_section, scan_entities, scan_tables
+
+# A "0" code line followed by an entity type name. Value lines are always
+# followed by a (digits only) code line, so this can't match mid-record.
+_ENTITY_START_RE = re.compile(rb"\n[ \t]*0\r?\n[0-9]*[A-Z_][A-Z0-9_]*\r?\n")
+
+
+def next_entity_start(buf, pos: int, end: int) -> int:
+    """Offset of the first entity starting at or after ``pos``, or ``end``"""
+    match = _ENTITY_START_RE.search(buf, pos - 1, end)
+    return end if match is None else match.start() + 1
+
+
+def plan_chunks(filepath: str, chunks: int):
+    """Split the ENTITIES section into at most ``chunks`` byte ranges.
+
+    Returns ``{"layers": ..., "encoding": ..., "styles": ..., "ranges": [(start, end), ...]}``
+    or None if the file can't be handled by the tag-level reader.
+    """
+    try:
+        return _plan_chunks(filepath, chunks)
+    except (OSError, ValueError) as e:
+        print(f"Could not split {filepath} into chunks: {e}")
+        return None
+
+
+def _plan_chunks(filepath: str, chunks: int):
+    with open(filepath, "rb") as f:
+        tables = scan_tables(f)
+        if tables is None:
+            return None
+        layer_table, encoding, styles = tables
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            section = find_section(buf, b"ENTITIES")
+            if section is None:
+                return None
+            start, end = section
+
+            bounds = [start]
+            step = max(1, (end - start) // max(1, chunks))
+            for i in range(1, chunks):
+                boundary = next_entity_start(buf, max(start + i * step, bounds[-1]), end)
+                if boundary == end:
+                    break
+                if boundary > bounds[-1]:
+                    bounds.append(boundary)
+            bounds.append(end)
+
+    return {
+        "layers": layer_table,
+        "encoding": encoding,
+        "styles": styles,
+        "ranges": list(zip(bounds[:-1], bounds[1:])),
+    }
+
+
+def scan_chunk(filepath: str, start: int, end: int, encoding: str, styles: list,
+               preview_limit: Optional[int] = None, share_dir: Optional[str] = None):
+    """Scan one byte range; returns ``(EntityTotals, peak_rss_mb)`` or None.
+
+    With ``share_dir`` set, the preview geometry comes back shared through a
+    file (``geometry.share``) and must be attached or released.
+    """
+    from .dwg_service import peak_rss_mb
+
+    try:
+        with open(filepath, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                totals = EntityTotals(record=True)
+                if not scan_entities(buf, start, end, encoding, styles, totals, preview_limit):
+                    return None
+    except (OSError, ValueError) as e:
+        print(f"Could not scan chunk {start}-{end} of {filepath}: {e}")
+        return None
+    if share_dir:
+        totals.entities = share(totals.entities, share_dir)
+    return totals, peak_rss_mb()
+
+
+class AnalysisProgress:
+    """Totals of the leading chunks of a file merged so far.
+
+    Chunks are merged from a worker thread while requests read snapshots from
+    others, so both hold the lock. Every merge also publishes the totals
+    without preview entities, for snapshots that can't wait for the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.layer_table = []
+        self.totals = EntityTotals()
+        self.chunks = 0
+        self.chunks_done = 0
+        self._publish()
+
+    def _publish(self):
+        count = len(self.totals.entities)
+        self._published = count, build_result(self.layer_table, self.totals, count)
+
+    def start(self, layer_table, chunks: int):
+        with self._lock:
+            self.layer_table = layer_table
+            self.chunks = chunks
+            self._publish()
+
+    def merge(self, part: EntityTotals, preview_limit: Optional[int] = None):
+        """Fold in the next chunk in file order"""
+        with self._lock:
+            self.totals.merge(part, preview_limit)
+            self.chunks_done += 1
+            self._publish()
+
+    def snapshot(self, preview_from: Optional[int] = None, limit: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        """An ``analyze_file`` result (without metadata) of the chunks merged so far.
+
+        Only the preview entities from the ``preview_from``-th on are copied
+        (none if it is None), at most ``limit`` of them; ``preview["start"]``
+        is the index of the first. If a chunk is still being merged after
+        ``timeout`` seconds, the totals published by the previous merge are
+        returned instead, without preview entities.
+        """
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            count, published = self._published
+            start = count if preview_from is None else min(preview_from, count)
+            return dict(published, preview=dict(published["preview"], start=start))
+        try:
+            start = len(self.totals.entities)
+            if preview_from is not None:
+                start = min(preview_from, start)
+            stop = None if limit is None else start + limit
+            result = build_result(self.layer_table, self.totals, start, stop)
+        finally:
+            self._lock.release()
+        result["preview"]["start"] = start
+        return result
+
+    def result(self):
+        """The result of all chunks, once every chunk has been merged"""
+        with self._lock:
+            return build_result(self.layer_table, self.totals)
+
+
+async def parallel_analyze(pool, filepath: str, chunks: int, preview_limit: Optional[int] = None,
+                           progress: Optional[AnalysisProgress] = None,
+                           share_dir: Optional[str] = None):
+    """Analyze a file by scanning its ENTITIES chunks on ``pool`` concurrently.
+
+    Returns the same structure as ``analyze_file`` or None if the tag-level
+    reader can't handle the file, in which case the caller falls back to the
+    serial path. Pass ``progress`` to follow the chunks merged so far and
+    ``share_dir`` to have the workers share their preview geometry instead
+    of pickling it; ``share_dir`` is deleted once the workers of abandoned
+    chunks are done, so it must not be used for anything else.
+    """
+    started = time.perf_counter()
+    plan = await pool.run(plan_chunks, filepath, chunks)
+    if plan is None:
+        return None
+
+    if progress is None:
+        progress = AnalysisProgress()
+    progress.start(plan["layers"], len(plan["ranges"]))
+    abandoned = partial(release_directory, share_dir) if share_dir else None
+    scans = [
+        asyncio.ensure_future(pool.run(scan_chunk, filepath, start, end, plan["encoding"],
+                                       plan["styles"], preview_limit, share_dir,
+                                       abandoned=abandoned))
+        for start, end in plan["ranges"]
+    ]
+    peak_rss = 0.0
+    try:
+        # Merge in file order while the later chunks are still being scanned
+        for scan in scans:
+            scanned = await scan
+            if scanned is None:
+                return None
+            totals, rss = scanned
+            totals.entities = attach(totals.entities)
+            peak_rss = max(peak_rss, rss)
+            await run_in_threadpool(progress.merge, totals, preview_limit)
+    finally:
+        for scan in scans:
+            scan.cancel()
+        # Collect the outcome of the chunks that were no longer awaited
+        for scanned in await asyncio.gather(*scans, return_exceptions=True):
+            if isinstance(scanned, tuple):
+                release(scanned[0].entities)
+
+    result = await run_in_threadpool(progress.result)
+    result["metadata"] = {
+        "mode": "parallel",
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "peak_rss_mb": peak_rss,
+    }
+    return result
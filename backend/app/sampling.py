@@ -0,0 +1,193 @@
+"""Approximate layer statistics from a stratified sample of the ENTITIES section.
+
+The ENTITIES section is cut into fixed-size windows (at entity boundaries, so
+every entity belongs to exactly one window) and the windows are grouped into
+strata of consecutive windows. A few windows are drawn at random from every
+stratum and scanned with the tag-level reader. Each window's per-layer
+counts, lengths and areas per byte are then extrapolated to the size of
+the stratum, which gives estimates of the totals and, from the spread
+between windows of the same stratum, their confidence intervals. Drawings tend to be written
+layer by layer or region by region, so stratifying by position keeps every
+part of the file represented in the sample.
+
+Only the sampled windows of the memory-mapped file are read, so the time
+taken is bounded by the sample size rather than by the file size. Compressed
+uploads can't be read at random offsets, so they are decompressed to a
+temporary file first, which takes a pass over the file but no more memory.
+"""
+import math
+import mmap
+import random
+import time
+from typing import Dict, List, Optional
+
+from .parallel import next_entity_start
+from .storage import local_copy
+from .tagreader import EntityTotals, build_result, find_section, scan_entities, scan_tables
+
+# Two-sided 95% normal quantile
+Z_95 = 1.96
+STRATA = 8
+WINDOW_BYTES = 64 * 1024
+
+
+class _Stratum:
+    """Windows drawn from one stratum and their sizes and values.
+
+    Windows are cut at entity boundaries and the last one of the section is
+    short, so totals are estimated per byte (a ratio estimator) and scaled
+    by the stratum's size rather than by its number of windows.
+    """
+
+    def __init__(self, windows: int, drawn: int, size: int):
+        self.windows = windows
+        self.drawn = drawn
+        self.size = size
+        self.sizes: List[int] = []
+        self.values: Dict[tuple, List[float]] = {}
+
+    def add(self, key: tuple, value: float):
+        """Record ``value`` of ``key`` in the window added last"""
+        values = self.values.setdefault(key, [])
+        # Windows without the key count as 0 for it
+        values.extend([0.0] * (len(self.sizes) - 1 - len(values)))
+        values.append(value)
+
+    def estimate(self, key: tuple):
+        """Estimated stratum total of ``key`` and its variance"""
+        values = self.values.get(key, [])
+        values = values + [0.0] * (self.drawn - len(values))
+        if self.drawn == self.windows:
+            return sum(values), 0.0
+        sampled = sum(self.sizes)
+        if not sampled:
+            return 0.0, 0.0
+        rate = sum(values) / sampled
+        if self.drawn < 2:
+            return rate * self.size, 0.0
+        residuals = sum((v - rate * b) ** 2 for v, b in zip(values, self.sizes))
+        variance = residuals / (self.drawn - 1)
+        # Sampling without replacement: finite population correction
+        fpc = 1.0 - self.drawn / self.windows
+        return rate * self.size, self.windows ** 2 * fpc * variance / self.drawn
+
+
+def _interval(estimate: float, variance: float, observed: float) -> List[float]:
+    # The sampled windows alone hold ``observed``, so the total is no less
+    half_width = Z_95 * math.sqrt(variance)
+    return [round(max(observed, estimate - half_width), 4), round(estimate + half_width, 4)]
+
+
+def approx_analyze(filepath: str, sample_bytes: int, seed: Optional[int] = None):
+    """Estimate the layer statistics and measurements of an ASCII DXF file.
+
+    Scans about ``sample_bytes`` of the ENTITIES section. Returns the
+    structure of ``analyze_file`` without the preview, with 95% confidence
+    intervals (``*_ci``) next to the estimated layer and total figures, or
+    None if the tag-level reader can't handle the file. Files whose
+    ENTITIES section fits in the sample are scanned whole. Runs in a worker
+    process.
+    """
+    from .dwg_service import peak_rss_mb
+
+    started = time.perf_counter()
+    try:
+        with local_copy(filepath) as path, open(path, "rb") as f:
+            tables = scan_tables(f)
+            if tables is None:
+                return None
+            layer_table, encoding, styles = tables
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                section = find_section(buf, b"ENTITIES")
+                if section is None:
+                    return None
+                sample = _sample(buf, section[0], section[1], encoding, styles, sample_bytes,
+                                 random.Random(seed))
+    except (OSError, ValueError, EOFError) as e:
+        print(f"Could not sample {filepath}: {e}")
+        return None
+    if sample is None:
+        return None
+
+    strata, totals, sampled = sample
+    section_bytes = section[1] - section[0]
+    result = build_result(layer_table, totals)
+    del result["preview"]
+
+    def estimate(key: tuple, observed: float):
+        total = variance = 0.0
+        for stratum in strata:
+            value, var = stratum.estimate(key)
+            total += value
+            variance += var
+        return total, _interval(total, variance, observed)
+
+    for layer in result["layers"]:
+        name = layer["name"]
+        for field, key, sums in (("entity_count", "count", totals.counts),
+                                 ("line_length", "length", totals.lengths),
+                                 ("closed_area", "area", totals.areas)):
+            value, layer[f"{field}_ci"] = estimate((key, name), sums.get(name, 0))
+            layer[field] = round(value) if field == "entity_count" else round(value, 4)
+
+    measurements = result["measurements"]
+    for field, key, observed in (("total_entities", "total", totals.total),
+                                 ("total_line_length", "total_length", sum(totals.lengths.values())),
+                                 ("total_closed_area", "total_area", sum(totals.areas.values()))):
+        value, measurements[f"{field}_ci"] = estimate((key,), observed)
+        measurements[field] = round(value) if field == "total_entities" else round(value, 4)
+
+    result["metadata"] = {
+        "mode": "approx",
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "peak_rss_mb": peak_rss_mb(),
+        "sample_fraction": round(min(1.0, sampled / section_bytes), 4) if section_bytes else 1.0,
+    }
+    return result
+
+
+def _sample(buf, start: int, end: int, encoding: str, styles: list, sample_bytes: int,
+            rng: random.Random):
+    """Scan random windows of every stratum of ``buf[start:end]``.
+
+    Returns the strata, the totals of all scanned windows (for the observed
+    values and the extents) and the number of bytes scanned, or None if a
+    window holds an entity the tag-level reader can't handle.
+    """
+    windows = max(1, math.ceil((end - start) / WINDOW_BYTES))
+    draws = max(1, sample_bytes // WINDOW_BYTES)
+    strata_count = min(STRATA, windows)
+    strata = []
+    totals = EntityTotals()
+    sampled = 0
+
+    for h in range(strata_count):
+        first = h * windows // strata_count
+        last = (h + 1) * windows // strata_count
+        # Allocate draws in proportion to the stratum's size, at least two
+        # per stratum for a variance estimate
+        drawn = min(last - first, max(2, round(draws * (last - first) / windows)))
+        size = min(end, start + last * WINDOW_BYTES) - (start + first * WINDOW_BYTES)
+        stratum = _Stratum(last - first, drawn, size)
+        for window in sorted(rng.sample(range(first, last), drawn)):
+            lo = start + window * WINDOW_BYTES
+            hi = min(end, lo + WINDOW_BYTES)
+            lo = start if window == 0 else next_entity_start(buf, lo, end)
+            hi = next_entity_start(buf, hi, end)
+            part = EntityTotals()
+            if lo < hi and not scan_entities(buf, lo, hi, encoding, styles, part, 0):
+                return None
+            sampled += hi - lo
+
+            stratum.sizes.append(hi - lo)
+            stratum.add(("total",), part.total)
+            stratum.add(("total_length",), sum(part.lengths.values()))
+            stratum.add(("total_area",), sum(part.areas.values()))
+            for layer, count in part.counts.items():
+                stratum.add(("count", layer), count)
+                stratum.add(("length", layer), part.lengths[layer])
+                stratum.add(("area", layer), part.areas[layer])
+            totals.add(part)
+        strata.append(stratum)
+
+    return strata, totals, sampled
@@ -0,0 +1,93 @@
+"""Memory-mapped geometry sidecars: analysis results stored on disk.
+
+A sidecar is a directory holding the columns of the preview's
+``GeometryStore`` as ``.npy`` files, plus the layers, measurements, bounding
+box and metadata as JSON. It is the disk level of ``AnalysisCache``: once an
+analysis has left memory (evicted, expired or lost in a restart), it is read
+back from its sidecar instead of parsing the drawing again. The arrays are
+memory-mapped, so loading a sidecar takes about the same time whatever the
+size of the drawing. Every process that maps a sidecar shares its pages
+through the OS page cache.
+
+A sidecar is written under a temporary name and renamed into place, so it is
+either complete or absent. ``SIDECAR_VERSION`` is the version of this layout
+(what the extractors produce is versioned by the cache key); sidecars of
+another layout are ignored.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+from .geometry import GeometryStore
+
+SIDECAR_VERSION = 1
+_ANALYSIS = "analysis.json"
+
+
+def has_sidecar(path: str) -> bool:
+    return os.path.exists(os.path.join(path, _ANALYSIS))
+
+
+def save_sidecar(path: str, result: dict) -> bool:
+    """Write an ``analyze_file`` result as the sidecar directory ``path``"""
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                dir=os.path.dirname(path))
+    try:
+        result["preview"]["entities"].save(tmp_path)
+        with open(os.path.join(tmp_path, _ANALYSIS), "w") as f:
+            # Dimension measurements can be ezdxf vectors
+            json.dump({
+                "version": SIDECAR_VERSION,
+                "layers": result["layers"],
+                "measurements": result["measurements"],
+                "bounding_box": result["preview"]["bounding_box"],
+                "metadata": result["metadata"],
+            }, f, default=list)
+        # Replace a sidecar of an older layout
+        remove_sidecar(path)
+        os.rename(tmp_path, path)
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Could not save geometry sidecar {path}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return False
+
+
+def load_sidecar(path: str) -> Optional[dict]:
+    """Read the sidecar directory ``path`` as an ``analyze_file`` result.
+
+    Returns None if there is no usable sidecar. The metadata is that of the
+    analysis that wrote it, except for ``mode`` ("sidecar") and the duration.
+    """
+    started = time.perf_counter()
+    try:
+        with open(os.path.join(path, _ANALYSIS)) as f:
+            data = json.load(f)
+        if data.get("version") != SIDECAR_VERSION:
+            return None
+        entities = GeometryStore.load(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable geometry sidecar {path}: {e}")
+        return None
+
+    metadata = dict(data["metadata"])
+    metadata["mode"] = "sidecar"
+    metadata["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {
+        "layers": data["layers"],
+        "measurements": data["measurements"],
+        "preview": {
+            "bounding_box": data["bounding_box"],
+            "entities": entities,
+        },
+        "metadata": metadata,
+    }
+
+
+def remove_sidecar(path: str):
+    shutil.rmtree(path, ignore_errors=True)
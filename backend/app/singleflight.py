@@ -0,0 +1,70 @@
+"""Per-key coalescing of concurrent work onto a single in-flight task"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+
+class WorkAbandoned(Exception):
+    """The shared task was cancelled because every waiter holding it left"""
+
+
+class SingleFlight:
+    """Registry of in-flight tasks keyed by e.g. ``("parse", file_id)``.
+
+    The first caller for a key starts the work; callers arriving while it is
+    still running await the same task and share its result or exception.
+    A waiter being cancelled (client went away) does not cancel the shared
+    task while other waiters still hold it, but once the last one has left
+    the task is cancelled too, unless it was kept with ``keep``. Callers
+    passing ``hold=False`` wait without holding the task, e.g. background
+    jobs that would like the result but don't need it. Once the task
+    finishes, or while it is being cancelled, the next call starts fresh
+    work.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._holders: Dict[Hashable, int] = {}
+        self._kept: Set[Hashable] = set()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]], hold: bool = True) -> Any:
+        task = self._inflight.get(key)
+        if task is None or task.cancelling():
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            self._holders[key] = 0
+            self._kept.discard(key)
+            task.add_done_callback(lambda t: self._release(key, t))
+        if hold:
+            self._holders[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The shared task was cancelled rather than this waiter
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                raise WorkAbandoned("The work was cancelled after its clients went away") from None
+            raise
+        finally:
+            if hold and self._inflight.get(key) is task:
+                self._holders[key] -= 1
+                if not self._holders[key] and key not in self._kept and not task.done():
+                    task.cancel()
+
+    def keep(self, key: Hashable) -> None:
+        """Let the in-flight task for ``key`` finish even if every waiter leaves"""
+        if key in self._inflight:
+            self._kept.add(key)
+
+    def _release(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._holders[key]
+            self._kept.discard(key)
+        # Mark the exception as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,234 @@
+"""Compressed on-disk storage of uploaded drawings.
+
+ASCII DXF compresses 5-10x with gzip, so uploads are kept as ``<id>.dxf.gz``.
+Readers that work on a stream (the ezdxf loaders, the table scan) decompress
+on the fly; readers that need a real file (mmap, ``iterdxf``, parallel
+chunks) get a temporary decompressed copy from ``local_copy``.
+
+Clients may also upload ``.dxf.gz`` or single-entry ``.zip`` files; these are
+decompressed as a stream while being stored, with a limit on the
+decompressed size.
+
+Uploads are content-addressed: an upload is written to a temporary name and
+hashed as it streams in, then moved to ``<sha256><ext>`` in the blob
+directory, or dropped if that content is already stored. Files uploaded
+several times share one blob (and its analysis); the file store counts the
+references to each.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+GZIP_SUFFIX = ".gz"
+ZIP_SUFFIX = ".zip"
+# Level 6 compresses DXF nearly as well as 9 at about twice the speed
+GZIP_LEVEL = 6
+DRAWING_EXTENSIONS = (".dxf", ".dwg")
+COPY_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """An upload is (or decompresses to) more than the allowed size"""
+
+
+class _LimitedReader:
+    """Read a possibly decompressing stream, enforcing a size limit.
+
+    Decompression errors are raised as ``ValueError``.
+    """
+
+    def __init__(self, stream: BinaryIO, limit: Optional[int] = None):
+        self._stream = stream
+        self.limit = limit
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            data = self._stream.read(size)
+        except (EOFError, zlib.error, zipfile.BadZipFile, gzip.BadGzipFile) as e:
+            raise ValueError(f"Corrupt compressed upload: {e}")
+        self.size += len(data)
+        if self.limit and self.size > self.limit:
+            raise UploadTooLarge(
+                f"File exceeds the maximum size of {self.limit // (1024 * 1024)} MB"
+            )
+        return data
+
+
+def open_drawing(source: BinaryIO, filename: str,
+                 limit: Optional[int] = None) -> Tuple[BinaryIO, str]:
+    """Unpack an uploaded file.
+
+    Returns a stream of the drawing's bytes, which raises ``UploadTooLarge``
+    once more than ``limit`` bytes have been read, and the drawing's
+    extension (``.dxf`` or ``.dwg``). ``.gz`` uploads and ``.zip`` archives
+    with a single file are decompressed as the stream is read. Raises
+    ``ValueError`` for unsupported or malformed uploads.
+    """
+    name = filename.lower()
+    if name.endswith(ZIP_SUFFIX):
+        try:
+            archive = zipfile.ZipFile(source)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Invalid ZIP file: {e}")
+        entries = [info for info in archive.infolist() if not info.is_dir()]
+        if len(entries) != 1:
+            raise ValueError("ZIP uploads must contain exactly one drawing")
+        name = entries[0].filename.lower()
+        try:
+            stream = archive.open(entries[0])
+        except (RuntimeError, NotImplementedError) as e:
+            # Encrypted entries or unsupported compression methods
+            raise ValueError(f"Can't read ZIP entry: {e}")
+    elif name.endswith(GZIP_SUFFIX):
+        name = name[:-len(GZIP_SUFFIX)]
+        stream = gzip.GzipFile(fileobj=source, mode="rb")
+    else:
+        stream = source
+
+    ext = os.path.splitext(name)[1]
+    if ext not in DRAWING_EXTENSIONS:
+        raise ValueError("Only .dxf and .dwg files are supported")
+    return _LimitedReader(stream, limit), ext
+
+
+def is_compressed(path: str) -> bool:
+    return path.lower().endswith(GZIP_SUFFIX)
+
+
+def original_path(path: str) -> str:
+    """``path`` without the compression suffix"""
+    return path[:-len(GZIP_SUFFIX)] if is_compressed(path) else path
+
+
+def find_upload(path: str) -> Optional[str]:
+    """The stored file for an upload at ``path``, compressed or not"""
+    for candidate in (path + GZIP_SUFFIX, path):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def blob_path(directory: str, sha256: str, ext: str) -> str:
+    """Path (before any compression suffix) of the stored content ``sha256``"""
+    return os.path.join(directory, sha256 + ext)
+
+
+def store_blob(upload: str, path: str) -> bool:
+    """Move a written upload (as found by ``find_upload``) to the blob ``path``.
+
+    If that content is stored already, the upload is removed instead.
+    Returns whether the upload was moved.
+    """
+    if find_upload(path) is not None:
+        os.remove(upload)
+        return False
+    os.rename(upload, path + (GZIP_SUFFIX if is_compressed(upload) else ""))
+    return True
+
+
+def allocate_upload(path: str, size: int):
+    """Create ``path`` as a (sparse) file of ``size`` bytes, for chunks
+    written in any order"""
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def write_at(fd: int, offset: int, data: bytes):
+    """Write all of ``data`` at ``offset`` of the open file ``fd``"""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def write_upload(source: BinaryIO, path: str, compress: bool = True) -> Tuple[int, str]:
+    """Copy ``source`` to ``path`` (plus ``.gz`` if compressing).
+
+    Returns the uncompressed size in bytes and the SHA-256 of the
+    uncompressed content, which identifies a drawing however it was uploaded.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with (gzip.open(path + GZIP_SUFFIX, "wb", compresslevel=GZIP_LEVEL) if compress
+          else open(path, "wb")) as out:
+        while True:
+            chunk = source.read(COPY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 of a stored upload's uncompressed content"""
+    digest = hashlib.sha256()
+    with open_upload(path) as f:
+        while True:
+            chunk = f.read(COPY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_upload(path: str) -> BinaryIO:
+    """Open a stored upload for binary reading, decompressing transparently"""
+    if is_compressed(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def upload_size(path: str) -> int:
+    """Uncompressed size of a stored upload"""
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    # The gzip trailer ends with the input size modulo 2**32
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", f.read(4))[0]
+
+
+def decompressed_copy(path: str) -> str:
+    """Decompress a stored upload to a temporary file next to it.
+
+    The caller removes the returned file when done with it.
+    """
+    base, ext = os.path.splitext(original_path(path))
+    fd, tmp_path = tempfile.mkstemp(suffix=ext, prefix=os.path.basename(base) + ".",
+                                    dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as out, gzip.open(path, "rb") as src:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+@contextmanager
+def local_copy(path: str) -> Iterator[str]:
+    """Yield the path of an uncompressed version of a stored upload.
+
+    Plain files are yielded as they are; compressed ones are decompressed to
+    a temporary file, which is removed afterwards.
+    """
+    if not is_compressed(path):
+        yield path
+        return
+
+    tmp_path = decompressed_copy(path)
+    try:
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
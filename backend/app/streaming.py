@@ -0,0 +1,101 @@
+"""Constant-memory, single-pass analysis for very large DXF files.
+
+``ezdxf.readfile`` builds the whole document in memory, which for site plans
+of several hundred MB is more than a free-tier instance has. Here the LAYER
+and STYLE tables are read straight from the tags (see ``tagreader.py``) and modelspace
+entities are streamed one at a time with ``ezdxf.addons.iterdxf``, so memory
+use doesn't grow with the file size (apart from the capped preview list and
+the dimensions).
+"""
+from .dwg_service import (
+    accumulate_layer_stats, add_entity, dimension_data,
+    make_bounding_box, make_layer_info
+)
+from .geometry import PREVIEW_TYPE_NAMES, GeometryBuilder
+from .models import BoundingBox, Measurements
+from .tagreader import ExtentsDocument, scan_tables
+
+
+def stream_analyze(filepath: str, preview_limit: int = 0):
+    """Compute layers, measurements and a capped preview in one forward pass.
+
+    Returns the same structure as ``analyze_file`` or None if the file can't
+    be streamed (binary DXF, structural errors), in which case the caller
+    falls back to a full parse. At most ``preview_limit`` preview entities are
+    kept.
+    """
+    from ezdxf import bbox
+    from ezdxf.addons import iterdxf
+    from ezdxf.math import BoundingBox as Extents
+
+    try:
+        with open(filepath, "rb") as stream:
+            tables = scan_tables(stream)
+        if tables is None:
+            return None
+        layer_table, encoding, styles = tables
+        document = None
+
+        counts, lengths, areas = {}, {}, {}
+        extents = Extents()
+        total_entities = 0
+        dimensions = []
+        entities = GeometryBuilder()
+
+        # single_pass_modelspace() drops the last entity of the section
+        for entity in iterdxf.modelspace(filepath):
+            total_entities += 1
+            accumulate_layer_stats(entity, counts, lengths, areas)
+
+            if entity.dxftype() in ("TEXT", "MTEXT"):
+                # Streamed entities have no document; text is measured with
+                # the drawing's text styles, as after ezdxf.readfile
+                if document is None:
+                    document = ExtentsDocument(styles, encoding)
+                entity.doc = document.doc
+            try:
+                box = bbox.extents([entity])
+                if box.has_data:
+                    extents.extend([box.extmin, box.extmax])
+            except Exception:
+                pass
+
+            if entity.dxftype() == "DIMENSION":
+                try:
+                    dimensions.append(dimension_data(entity))
+                except Exception as e:
+                    print(f"Error extracting dimension: {e}")
+
+            if len(entities) < preview_limit and entity.dxftype() in PREVIEW_TYPE_NAMES:
+                add_entity(entities, entity)
+    except MemoryError:
+        raise
+    except Exception as e:
+        print(f"Error streaming file {filepath}: {e}")
+        return None
+
+    if extents.has_data:
+        bounding_box = make_bounding_box(extents.extmin, extents.extmax)
+    else:
+        bounding_box = BoundingBox(min_x=0, min_y=0, min_z=0, max_x=0, max_y=0, max_z=0, width=0, height=0, depth=0)
+
+    layers = [
+        make_layer_info(name, color, visible, counts, lengths, areas)
+        for name, color, visible in layer_table
+    ]
+    measurements = Measurements(
+        total_entities=total_entities,
+        bounding_box=bounding_box,
+        total_line_length=round(sum(layer.line_length for layer in layers), 4),
+        total_closed_area=round(sum(layer.closed_area for layer in layers), 4),
+        dimensions=dimensions
+    )
+
+    return {
+        "layers": [layer.model_dump() for layer in layers],
+        "measurements": measurements.model_dump(),
+        "preview": {
+            "bounding_box": bounding_box.model_dump(),
+            "entities": entities.build(),
+        },
+    }
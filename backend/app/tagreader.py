@@ -0,0 +1,609 @@
+"""Tag-level DXF reader for the preview and the layer statistics.
+
+The dashboard only needs a handful of entity types plus the LAYER table, so
+instead of building ezdxf's object model this reader walks the group codes
+itself. The file is memory-mapped, the TABLES and ENTITIES sections are found
+by byte offset and only those ranges are read: CLASSES, BLOCKS and OBJECTS
+are skipped entirely. The ENTITIES range is sliced through a memoryview and
+split into lines one window at a time, so memory stays bounded and no Python
+object is kept per entity: the preview goes into the typed arrays of a
+``GeometryBuilder`` (see ``geometry.py``).
+
+Anything the reader doesn't understand (binary DXF, other entity types such
+as DIMENSION, whose extents need its block, extrusions other than +Z) makes it
+return None; the caller then falls back to ``ezdxf.readfile``. The bounding
+box must match ``build_geometry``'s: lines, circles, arcs and straight
+polylines are measured here, while text, hatches and polylines with bulges are
+loaded as single ezdxf entities from their own tags and measured by ezdxf (see
+``ExtentsDocument``), as the font and the Bézier approximation of curves
+decide their extents.
+"""
+import codecs
+import math
+import mmap
+import re
+from array import array
+from typing import BinaryIO, List, Optional, Tuple
+
+from .geometry import ARC, CIRCLE, LINE, LWPOLYLINE, MTEXT, TEXT, GeometryBuilder
+from .models import BoundingBox, Measurements
+from .storage import is_compressed, open_upload, original_path
+
+# Entity types this reader handles; anything else triggers the fallback
+SUPPORTED_TYPES = frozenset({
+    b"LINE", b"LWPOLYLINE", b"CIRCLE", b"ARC", b"TEXT", b"MTEXT", b"HATCH"
+})
+
+# Entity types whose tags are kept for ``ExtentsDocument``
+_TAGGED_TYPES = frozenset({b"LWPOLYLINE", b"TEXT", b"MTEXT", b"HATCH"})
+
+# Bytes of the ENTITIES section split into lines at a time
+WINDOW_SIZE = 8 * 1024 * 1024
+
+_BINARY_SENTINEL = b"AutoCAD Binary DXF\r\n\x1a\x00"
+_SECTION_RE = re.compile(rb"(?:^|\n)[ \t]*0\r?\nSECTION\r?\n[ \t]*2\r?\n([A-Z]+)\r?\n")
+_ENDSEC_RE = re.compile(rb"\n[ \t]*0\r?\nENDSEC\r?\n")
+
+
+def _text_encoding(acadver: str, codepage: str) -> str:
+    # R2007+ files are always UTF-8, older ones use $DWGCODEPAGE, e.g.
+    # ANSI_1252 or DOS932. Resolved locally: importing ezdxf would cost more
+    # than the whole quick layer scan.
+    if acadver >= "AC1021":
+        return "utf8"
+    digits = "".join(c for c in codepage if c.isdigit())
+    try:
+        return codecs.lookup(f"cp{digits}").name
+    except LookupError:
+        return "cp1252"
+
+
+def _decode(value: bytes, encoding: str) -> str:
+    return value.rstrip(b"\r").decode(encoding, "surrogateescape")
+
+
+def scan_tables(stream: BinaryIO) -> Optional[Tuple[List[Tuple[str, int, bool]], str, List[list]]]:
+    """Read the LAYER and STYLE tables and the text encoding from the start of a file.
+
+    Returns ``([(name, color, visible), ...], encoding, styles)`` where
+    ``styles`` holds the raw ``(code, value)`` tags of every STYLE table entry
+    for ``ExtentsDocument``. Reading stops at the end of the TABLES section (or
+    at ENTITIES for files without one). Returns None for binary DXF files,
+    which can't be read line by line.
+    """
+    if stream.read(22) == _BINARY_SENTINEL:
+        return None
+    stream.seek(0)
+
+    raw_layers = []
+    styles = []
+    current = None
+    style = None
+    last_structure = b""
+    section = b""
+    table = b""
+    header_var = b""
+    acadver = "AC1009"
+    codepage = "ANSI_1252"
+
+    while True:
+        code = stream.readline()
+        line = stream.readline()
+        if not line:
+            break
+        code = code.strip()
+        value = line.strip()
+
+        if code == b"0":
+            if current is not None:
+                raw_layers.append(current)
+                current = None
+            style = None
+            if table == b"LAYER" and value == b"LAYER":
+                current = {"name": b"", "color": 7}
+            elif table == b"STYLE" and value == b"STYLE":
+                style = [(code, value)]
+                styles.append(style)
+            elif value == b"ENDTAB":
+                table = b""
+            elif value == b"ENDSEC" and section == b"TABLES":
+                break
+            last_structure = value
+            header_var = b""
+        elif style is not None:
+            style.append((code, line.rstrip(b"\n")))
+        elif code == b"2" and last_structure == b"SECTION":
+            if value == b"ENTITIES":
+                break
+            section = value
+            last_structure = b""
+        elif code == b"2" and last_structure == b"TABLE":
+            table = value
+            last_structure = b""
+        elif code == b"9":
+            header_var = value
+        elif code in (b"1", b"3") and header_var in (b"$ACADVER", b"$DWGCODEPAGE"):
+            if header_var == b"$ACADVER":
+                acadver = value.decode("ascii", "ignore")
+            else:
+                codepage = value.decode("ascii", "ignore")
+        elif current is not None:
+            if code == b"2":
+                current["name"] = value
+            elif code == b"62":
+                current["color"] = int(value)
+
+    encoding = _text_encoding(acadver, codepage)
+    # A negative colour marks a layer that is switched off; like doc.layers
+    # the raw value is reported as the layer's colour
+    layers = [
+        (_decode(layer["name"], encoding), layer["color"], layer["color"] >= 0)
+        for layer in raw_layers
+    ]
+    return layers, encoding, styles
+
+
+def read_layer_table(stream: BinaryIO) -> Optional[List[Tuple[str, int, bool]]]:
+    """Read ``(name, color, visible)`` for every LAYER table entry"""
+    tables = scan_tables(stream)
+    return tables[0] if tables is not None else None
+
+
+def quick_layers(filepath: str) -> Optional[List[dict]]:
+    """Layer names, colours and visibility from the HEADER and TABLES only.
+
+    Entity statistics are left at zero. Returns None if the file isn't an
+    ASCII DXF file.
+    """
+    from .dwg_service import make_layer_info
+
+    if not original_path(filepath).lower().endswith(".dxf"):
+        return None
+    try:
+        with open_upload(filepath) as f:
+            tables = scan_tables(f)
+    except (OSError, ValueError, EOFError) as e:
+        print(f"Quick layer scan of {filepath} failed: {e}")
+        return None
+    if tables is None:
+        return None
+    return [
+        make_layer_info(name, color, visible, {}, {}, {}).model_dump()
+        for name, color, visible in tables[0]
+    ]
+
+
+def find_section(buf, name: bytes) -> Optional[Tuple[int, int]]:
+    """Byte range of a section's content, from after its name to its ENDSEC"""
+    for match in _SECTION_RE.finditer(buf):
+        if match.group(1) == name:
+            start = match.end()
+            end = _ENDSEC_RE.search(buf, start - 1)
+            return (start, end.start() + 1) if end else None
+    return None
+
+
+class EntityTotals:
+    """Per-layer statistics, extents and preview geometry of scanned entities.
+
+    With ``record`` set, per-entity lengths and areas are kept in order
+    instead of being summed, so that totals of consecutive chunks can be
+    merged into exactly the sums a serial scan produces. The preview is a
+    ``GeometryBuilder``; ``merge`` also takes totals whose preview came back
+    from a worker as a ``GeometryStore``.
+    """
+
+    __slots__ = ("counts", "lengths", "areas", "total", "extmin", "extmax", "entities",
+                 "record", "length_parts", "area_parts")
+
+    def __init__(self, record: bool = False):
+        self.counts = {}
+        self.lengths = {}
+        self.areas = {}
+        self.total = 0
+        self.extmin = [math.inf, math.inf, math.inf]
+        self.extmax = [-math.inf, -math.inf, -math.inf]
+        self.entities = GeometryBuilder()
+        self.record = record
+        self.length_parts = {}
+        self.area_parts = {}
+
+    def add_layer(self, layer: str):
+        self.counts[layer] = 0
+        self.lengths[layer] = 0.0
+        self.areas[layer] = 0.0
+        if self.record:
+            self.length_parts[layer] = array("d")
+            self.area_parts[layer] = array("d")
+
+    def merge(self, other: "EntityTotals", preview_limit: Optional[int] = None):
+        """Fold in the recorded totals of the chunk that follows these"""
+        for layer, count in other.counts.items():
+            if layer not in self.counts:
+                self.add_layer(layer)
+            self.counts[layer] += count
+        for parts, sums in ((other.length_parts, self.lengths), (other.area_parts, self.areas)):
+            for layer, values in parts.items():
+                total = sums[layer]
+                for value in values:
+                    total += value
+                sums[layer] = total
+        self.total += other.total
+        for i in range(3):
+            self.extmin[i] = min(self.extmin[i], other.extmin[i])
+            self.extmax[i] = max(self.extmax[i], other.extmax[i])
+        if preview_limit is None:
+            self.entities.extend(other.entities)
+        else:
+            self.entities.extend(other.entities, preview_limit - len(self.entities))
+
+    def add(self, other: "EntityTotals"):
+        """Add the summed totals of another scan, in no particular order"""
+        for layer, count in other.counts.items():
+            if layer not in self.counts:
+                self.add_layer(layer)
+            self.counts[layer] += count
+            self.lengths[layer] += other.lengths[layer]
+            self.areas[layer] += other.areas[layer]
+        self.total += other.total
+        for i in range(3):
+            self.extmin[i] = min(self.extmin[i], other.extmin[i])
+            self.extmax[i] = max(self.extmax[i], other.extmax[i])
+
+    def extend(self, x: float, y: float, z: float = 0.0):
+        extmin, extmax = self.extmin, self.extmax
+        if x < extmin[0]:
+            extmin[0] = x
+        if x > extmax[0]:
+            extmax[0] = x
+        if y < extmin[1]:
+            extmin[1] = y
+        if y > extmax[1]:
+            extmax[1] = y
+        if z < extmin[2]:
+            extmin[2] = z
+        if z > extmax[2]:
+            extmax[2] = z
+
+    @property
+    def has_extents(self) -> bool:
+        return self.extmin[0] <= self.extmax[0]
+
+
+def _arc_extents(totals: EntityTotals, cx: float, cy: float, cz: float, r: float,
+                 start_angle: float, end_angle: float):
+    start = start_angle % 360.0
+    sweep = (end_angle - start_angle) % 360.0 or 360.0
+    for angle in (start, start + sweep):
+        rad = math.radians(angle)
+        totals.extend(cx + r * math.cos(rad), cy + r * math.sin(rad), cz)
+    # Quadrant points crossed by the sweep
+    quadrant = 90.0 * math.ceil(start / 90.0)
+    while quadrant < start + sweep:
+        rad = math.radians(quadrant)
+        totals.extend(cx + r * round(math.cos(rad)), cy + r * round(math.sin(rad)), cz)
+        quadrant += 90.0
+
+
+def _iter_windows(buf, start: int, end: int, window: int):
+    """Yield the lines of ``buf[start:end]`` a window at a time"""
+    view = memoryview(buf)
+    try:
+        pos = start
+        while pos < end:
+            stop = min(end, pos + window)
+            if stop < end:
+                newline = buf.rfind(b"\n", pos, stop)
+                if newline < 0:
+                    newline = buf.find(b"\n", stop, end)
+                stop = end if newline < 0 else newline + 1
+            lines = bytes(view[pos:stop]).split(b"\n")
+            if lines and lines[-1] == b"":
+                lines.pop()
+            yield lines
+            pos = stop
+    finally:
+        # An exported buffer would keep the mmap from closing
+        view.release()
+
+
+def _has_extrusion(fields: dict) -> bool:
+    return (float(fields.get(b"230", 1.0)) != 1.0
+            or float(fields.get(b"210", 0.0)) != 0.0
+            or float(fields.get(b"220", 0.0)) != 0.0)
+
+
+class ExtentsDocument:
+    """Measures single entities from their raw tags the way ``build_geometry`` does.
+
+    Each entity is loaded into a scratch ezdxf document that holds the
+    drawing's text styles, so text is measured with the same fonts as after
+    ``ezdxf.readfile``.
+    """
+
+    def __init__(self, styles: List[list], encoding: str):
+        import ezdxf
+
+        self.encoding = encoding
+        self.doc = ezdxf.new()
+        for tags in styles:
+            # Replaces the default entry of the same name, like Table.load
+            self.doc.styles._append(self._load(tags))
+
+    def _load(self, tags: List[Tuple[bytes, bytes]]):
+        from ezdxf.entities import factory
+        from ezdxf.lldxf.extendedtags import ExtendedTags
+        from ezdxf.lldxf.tagger import tag_compiler
+        from ezdxf.lldxf.types import DXFTag
+
+        encoding = self.encoding
+        compiled = [DXFTag(int(code), _decode(value, encoding)) for code, value in tags]
+        # The compiler looks one tag past a 2D point for its z value; in the
+        # file that's the 0 tag of the next entity
+        compiled.append(DXFTag(0, "EOF"))
+        compiled = list(tag_compiler(iter(compiled)))
+        compiled.pop()
+        return factory.load(ExtendedTags(compiled), self.doc)
+
+    def extents(self, tags: List[Tuple[bytes, bytes]]):
+        """``(extmin, extmax)`` of the entity, or None if it has no extents"""
+        from ezdxf import bbox
+
+        box = bbox.extents([self._load(tags)])
+        return (box.extmin, box.extmax) if box.has_data else None
+
+
+def scan_entities(buf, start: int, end: int, encoding: str, styles: List[list],
+                  totals: EntityTotals, preview_limit: Optional[int] = None,
+                  window: int = WINDOW_SIZE) -> bool:
+    """Accumulate the modelspace entities in ``buf[start:end]`` into ``totals``.
+
+    ``start`` must be at the beginning of a ``0`` group code line and
+    ``styles`` are the STYLE table entries from ``scan_tables``. Returns False
+    as soon as an entity the reader can't handle is found.
+    """
+    record = totals.record
+    layer_names = {}
+    fields = {}
+    xs, ys = [], []
+    chunks = []
+    tags = []
+    etype = None
+    collect = skip = False
+    document = None
+    carry = None
+
+    def measure() -> bool:
+        nonlocal document
+        try:
+            if document is None:
+                document = ExtentsDocument(styles, encoding)
+            extents = document.extents(tags)
+        except Exception as e:
+            print(f"Could not measure {etype.decode('ascii', 'replace')} from its tags: {e}")
+            return False
+        if extents is not None:
+            extmin, extmax = extents
+            totals.extend(extmin.x, extmin.y, extmin.z)
+            totals.extend(extmax.x, extmax.y, extmax.z)
+        return True
+
+    def finish():
+        if fields.get(b"67", b"0").strip() == b"1":
+            return True  # paperspace
+        if etype not in SUPPORTED_TYPES:
+            return False
+
+        raw_layer = fields.get(b"8", b"0")
+        layer = layer_names.get(raw_layer)
+        if layer is None:
+            layer = layer_names[raw_layer] = _decode(raw_layer, encoding)
+        if layer not in totals.counts:
+            totals.add_layer(layer)
+        totals.counts[layer] += 1
+        totals.total += 1
+
+        if etype != b"LINE" and _has_extrusion(fields):
+            return False
+
+        color = int(fields.get(b"62", 256))
+        keep = preview_limit is None or len(totals.entities) < preview_limit
+        preview = totals.entities
+
+        if etype == b"LINE":
+            sx = float(fields.get(b"10", 0.0))
+            sy = float(fields.get(b"20", 0.0))
+            ex = float(fields.get(b"11", 0.0))
+            ey = float(fields.get(b"21", 0.0))
+            length = math.sqrt((ex - sx)**2 + (ey - sy)**2)
+            if record:
+                totals.length_parts[layer].append(length)
+            else:
+                totals.lengths[layer] += length
+            totals.extend(sx, sy, float(fields.get(b"30", 0.0)))
+            totals.extend(ex, ey, float(fields.get(b"31", 0.0)))
+            if keep:
+                preview.add(LINE, layer, color, (sx, sy, ex, ey))
+
+        elif etype == b"LWPOLYLINE":
+            if len(xs) != len(ys):
+                return False
+            points = [(float(x), float(y)) for x, y in zip(xs, ys)]
+            closed = bool(int(fields.get(b"70", 0)) & 1)
+            # Same arithmetic as extract_layers so the totals are identical
+            if len(points) > 1:
+                length = 0
+                area = 0
+                for i in range(len(points)):
+                    x1, y1 = points[i][0], points[i][1]
+                    x2, y2 = points[(i + 1) % len(points)][0], points[(i + 1) % len(points)][1]
+                    length += math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+                    area += (x1 * y2) - (x2 * y1)
+                if record:
+                    totals.length_parts[layer].append(length)
+                else:
+                    totals.lengths[layer] += length
+                if closed:
+                    if record:
+                        totals.area_parts[layer].append(abs(area) / 2)
+                    else:
+                        totals.areas[layer] += abs(area) / 2
+            if any(code == b"42" and float(value) for code, value in tags):
+                if not measure():
+                    return False
+            else:
+                elevation = float(fields.get(b"38", 0.0))
+                for x, y in points:
+                    totals.extend(x, y, elevation)
+            if keep:
+                preview.add(LWPOLYLINE, layer, color, [v for point in points for v in point], closed)
+
+        elif etype == b"CIRCLE" or etype == b"ARC":
+            cx = float(fields.get(b"10", 0.0))
+            cy = float(fields.get(b"20", 0.0))
+            cz = float(fields.get(b"30", 0.0))
+            radius = float(fields.get(b"40", 1))
+            if etype == b"CIRCLE":
+                totals.extend(cx - radius, cy - radius, cz)
+                totals.extend(cx + radius, cy + radius, cz)
+                if keep:
+                    preview.add(CIRCLE, layer, color, (cx, cy, radius))
+            else:
+                start_angle = float(fields.get(b"50", 0))
+                end_angle = float(fields.get(b"51", 360))
+                _arc_extents(totals, cx, cy, cz, radius, start_angle, end_angle)
+                if keep:
+                    preview.add(ARC, layer, color, (cx, cy, radius, start_angle, end_angle))
+
+        elif etype == b"TEXT" or etype == b"MTEXT":
+            if not measure():
+                return False
+            if keep:
+                x = float(fields.get(b"10", 0.0))
+                y = float(fields.get(b"20", 0.0))
+                text = fields.get(b"1", b"")
+                if etype == b"MTEXT":
+                    text = b"".join(chunk.rstrip(b"\r") for chunk in chunks) + text
+                rotation = float(fields[b"50"]) if b"50" in fields else 0.0
+                preview.add(TEXT if etype == b"TEXT" else MTEXT, layer, color,
+                            (x, y, float(fields.get(b"40", 2.5)), rotation),
+                            text=_decode(text, encoding))
+
+        elif etype == b"HATCH":
+            if not measure():
+                return False
+        return True
+
+    for lines in _iter_windows(buf, start, end, window):
+        if carry is not None:
+            lines.insert(0, carry)
+        carry = lines.pop() if len(lines) % 2 else None
+
+        it = iter(lines)
+        for code, value in zip(it, it):
+            code = code.strip()
+            if code == b"0":
+                if etype is not None and not finish():
+                    return False
+                etype = value.strip()
+                fields.clear()
+                xs.clear()
+                ys.clear()
+                chunks.clear()
+                tags.clear()
+                collect = etype in _TAGGED_TYPES
+                if collect:
+                    tags.append((code, etype))
+                skip = False
+                continue
+            if collect:
+                tags.append((code, value))
+            if skip:
+                continue
+
+            if etype == b"LWPOLYLINE" and (code == b"10" or code == b"20"):
+                (xs if code == b"10" else ys).append(value)
+            elif etype == b"MTEXT" and code == b"3":
+                chunks.append(value)
+            elif etype == b"MTEXT" and code == b"101":
+                skip = True  # embedded object data, ignored by ezdxf as well
+            elif etype != b"HATCH":
+                fields[code] = value
+            elif code in (b"8", b"62", b"67", b"210", b"220", b"230"):
+                fields[code] = value  # HATCH boundary data is left to ezdxf
+
+    if etype is not None and etype != b"ENDSEC" and not finish():
+        return False
+    return True
+
+
+def build_result(layer_table: List[Tuple[str, int, bool]], totals: EntityTotals,
+                 preview_from: int = 0, preview_to: Optional[int] = None):
+    """Turn scanned totals into the structure returned by ``analyze_file``.
+
+    The preview only holds the entities from the ``preview_from``-th up to
+    the ``preview_to``-th.
+    """
+    from .dwg_service import make_bounding_box, make_layer_info
+
+    if totals.has_extents:
+        bounding_box = make_bounding_box(totals.extmin, totals.extmax)
+    else:
+        bounding_box = BoundingBox(min_x=0, min_y=0, min_z=0, max_x=0, max_y=0, max_z=0, width=0, height=0, depth=0)
+
+    layers = [
+        make_layer_info(name, color, visible, totals.counts, totals.lengths, totals.areas)
+        for name, color, visible in layer_table
+    ]
+    measurements = Measurements(
+        total_entities=totals.total,
+        bounding_box=bounding_box,
+        total_line_length=round(sum(layer.line_length for layer in layers), 4),
+        total_closed_area=round(sum(layer.closed_area for layer in layers), 4),
+        dimensions=[]
+    )
+
+    return {
+        "layers": [layer.model_dump() for layer in layers],
+        "measurements": measurements.model_dump(),
+        "preview": {
+            "bounding_box": bounding_box.model_dump(),
+            "entities": totals.entities.build(preview_from, preview_to),
+        },
+    }
+
+
+def fast_analyze(filepath: str, preview_limit: Optional[int] = None):
+    """Analyze an ASCII DXF file without ezdxf.
+
+    Returns the same structure as ``analyze_file`` (without metadata) or None
+    if the file needs the full ezdxf loader. Compressed uploads are
+    decompressed into memory, so large ones should be passed as a plain copy.
+    """
+    try:
+        with open_upload(filepath) as f:
+            tables = scan_tables(f)
+            if tables is None:
+                return None
+            layer_table, encoding, styles = tables
+            if is_compressed(filepath):
+                f.seek(0)
+                buf = f.read()
+            else:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                section = find_section(buf, b"ENTITIES")
+                if section is None:
+                    return None
+                totals = EntityTotals()
+                if not scan_entities(buf, section[0], section[1], encoding, styles, totals,
+                                     preview_limit):
+                    return None
+            finally:
+                if isinstance(buf, mmap.mmap):
+                    buf.close()
+    except (OSError, ValueError, EOFError) as e:
+        print(f"Fast reader could not read {filepath}: {e}")
+        return None
+
+    return build_result(layer_table, totals)
@@ -0,0 +1,230 @@
+"""Process pool that runs CPU-bound DXF analysis off the event loop"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+
+class AnalysisTimeout(Exception):
+    """A task ran longer than the pool's per-task timeout"""
+
+
+class AnalysisOutOfMemory(Exception):
+    """A task needed more memory than a worker is allowed to use"""
+
+
+class WorkerCrashed(Exception):
+    """The worker process running a task died"""
+
+
+class _PoolTornDown(Exception):
+    """The pool running a task was torn down because of another task"""
+
+
+# Attempts at a task whose pool keeps being torn down because of other tasks
+_ATTEMPTS = 3
+
+
+def _died_of_memory(processes) -> bool:
+    """Whether one of ``processes`` looks like it was killed for memory.
+
+    Native code can't always raise ``MemoryError`` when the address-space
+    limit is hit and aborts instead (SIGABRT), and the kernel's OOM killer
+    uses SIGKILL.
+    """
+    for process in processes:
+        process.join(1)
+        if process.exitcode in (-signal.SIGABRT, -signal.SIGKILL):
+            return True
+    return False
+
+
+def process_alive(pid: int) -> bool:
+    """Whether a process with this pid runs on this machine"""
+    if os.name == "nt":
+        return True  # os.kill would terminate it
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, OverflowError):
+        return False
+    except OSError:
+        pass  # exists but belongs to someone else
+    return True
+
+
+def _limit_memory(limit_bytes: int) -> None:
+    """Worker initializer capping the process' address space"""
+    try:
+        import resource
+    except ImportError:
+        return  # not available on Windows
+    resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+
+
+class WorkerPool:
+    """``ProcessPoolExecutor`` wrapper used for parsing and extraction.
+
+    Workers are replaced after ``max_tasks_per_child`` tasks so that heap
+    growth from large drawings is handed back to the OS. With
+    ``memory_limit_mb`` set, each worker's address space is capped, so a
+    pathological drawing fails with ``AnalysisOutOfMemory`` instead of
+    taking the API down with it. A task can't be interrupted inside its
+    process, and stopping one worker breaks the whole executor, so when a
+    task exceeds ``timeout`` seconds the pool is torn down and lazily
+    recreated; the other tasks that were running on it are resubmitted to
+    the new pool. When the caller of a running task is cancelled, the pool
+    is torn down too if no other task is running on it. When a worker dies
+    on its own, the tasks on the broken pool fail with ``WorkerCrashed``.
+
+    At most ``max_workers`` tasks are submitted at a time; the others wait
+    in ``run``: Python 3.11's executor hangs when a worker retires after
+    ``max_tasks_per_child`` tasks while more are queued. The timeout thus
+    only counts the time a task actually runs.
+
+    With ``max_workers=0`` tasks run in the threadpool instead, which is
+    handy for development and debugging.
+    """
+
+    def __init__(self, max_workers: int = 1, max_tasks_per_child: Optional[int] = None,
+                 timeout: Optional[float] = None, memory_limit_mb: Optional[float] = None):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.timeout = timeout or None
+        self.memory_limit_mb = memory_limit_mb or None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        # Pools torn down on purpose, whose other tasks are resubmitted
+        self._torn_down: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                initializer, initargs = None, ()
+                if self.memory_limit_mb:
+                    initializer = _limit_memory
+                    initargs = (int(self.memory_limit_mb * 1024 * 1024),)
+                # max_tasks_per_child requires spawn; it also keeps the
+                # workers from inheriting the API process' memory
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                    initializer=initializer,
+                    initargs=initargs,
+                )
+            return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor, on_purpose: bool = True) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            if on_purpose:
+                self._torn_down.add(pool)
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None,
+                  abandoned: Optional[Callable[[], None]] = None) -> Any:
+        """Run ``func(*args)`` in a worker and return its (picklable) result.
+
+        ``abandoned`` is called once the worker is done with a task whose
+        caller stopped waiting for it (cancelled or timed out), to clean up
+        whatever the task left behind.
+        """
+        timeout = timeout or self.timeout
+        if self.max_workers == 0:
+            # The threadpool finishes the call before the caller gets the
+            # cancellation or timeout
+            try:
+                return await asyncio.wait_for(run_in_threadpool(func, *args), timeout)
+            except asyncio.TimeoutError:
+                if abandoned is not None:
+                    abandoned()
+                raise AnalysisTimeout(f"Analysis exceeded {timeout:g}s")
+            except asyncio.CancelledError:
+                if abandoned is not None:
+                    abandoned()
+                raise
+            except MemoryError:
+                raise AnalysisOutOfMemory("Analysis ran out of memory")
+
+        for attempt in range(1, _ATTEMPTS + 1):
+            try:
+                return await self._run_in_pool(func, args, timeout, abandoned)
+            except _PoolTornDown:
+                if attempt == _ATTEMPTS:
+                    raise WorkerCrashed("The worker pool was restarted while analyzing the file")
+
+    async def _run_in_pool(self, func: Callable, args: tuple, timeout: Optional[float],
+                           abandoned: Optional[Callable[[], None]]) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        await self._slots.acquire()
+        try:
+            pool = self._get_pool()
+            submitted = pool.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is free once the worker is done with the task, even if
+        # the caller stopped waiting for it
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        submitted.add_done_callback(lambda _: loop.call_soon_threadsafe(self._task_done))
+
+        future = asyncio.wrap_future(submitted)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._discard(pool)
+            if abandoned is not None:
+                submitted.add_done_callback(lambda _: abandoned())
+            raise AnalysisTimeout(f"Analysis exceeded {timeout:g}s")
+        except asyncio.CancelledError:
+            if submitted.cancelled() and pool in self._torn_down and not asyncio.current_task().cancelling():
+                # Dropped from the queue of a pool torn down for another task
+                raise _PoolTornDown()
+            # Nobody wants the result any more. A running task can only be
+            # stopped by killing the pool, so only do that if it runs alone.
+            if not submitted.done() and self._in_flight == 1:
+                self._discard(pool)
+            if abandoned is not None:
+                # Once the worker has finished or died
+                submitted.add_done_callback(lambda _: abandoned())
+            raise
+        except MemoryError:
+            raise AnalysisOutOfMemory(
+                f"Analysis exceeded the worker memory limit of {self.memory_limit_mb:g} MB"
+                if self.memory_limit_mb else "Analysis ran out of memory"
+            )
+        except BrokenProcessPool:
+            if pool in self._torn_down:
+                # Killed because of another task: this one did nothing wrong
+                raise _PoolTornDown()
+            processes = list((pool._processes or {}).values())
+            self._discard(pool, on_purpose=False)
+            if self.memory_limit_mb and await run_in_threadpool(_died_of_memory, processes):
+                raise AnalysisOutOfMemory(
+                    f"Analysis exceeded the worker memory limit of {self.memory_limit_mb:g} MB"
+                )
+            raise WorkerCrashed("The worker process died while analyzing the file")
+
+    def _task_done(self) -> None:
+        self._in_flight -= 1
+        self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,48 @@
+"""Compare loading ASCII DXF with the binary DXF copy kept after the first parse.
+
+ASCII files are loaded with both the strict and the recover loader, since a
+file that needed recover mode is reloaded from its (clean) binary copy.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_binary
+"""
+import os
+
+import ezdxf
+from ezdxf import recover
+
+from app.dwg_service import binary_copy_path, save_binary_copy
+from benchmarks.common import best_of, scaled_sample
+
+FACTORS = (10, 100, 1000)
+
+
+def main():
+    print(f"{'entities':>10} {'ASCII MB':>9} {'binary MB':>10} {'ASCII s':>9} "
+          f"{'recover s':>10} {'binary s':>9} {'speedup':>8}")
+    for factor in FACTORS:
+        path = scaled_sample(factor)
+        binary_path = binary_copy_path(path)
+        try:
+            doc = ezdxf.readfile(path)
+            entities = len(doc.modelspace())
+            save_binary_copy(doc, path)
+            del doc
+
+            ascii_mb = os.path.getsize(path) / 1024 / 1024
+            binary_mb = os.path.getsize(binary_path) / 1024 / 1024
+            repeat = 1 if factor >= 1000 else 3
+            ascii_s = best_of(lambda: ezdxf.readfile(path), repeat)
+            recover_s = best_of(lambda: recover.readfile(path), repeat)
+            binary_s = best_of(lambda: ezdxf.readfile(binary_path), repeat)
+            print(f"{entities:>10} {ascii_mb:>9.2f} {binary_mb:>10.2f} {ascii_s:>9.3f} "
+                  f"{recover_s:>10.3f} {binary_s:>9.3f} {ascii_s / binary_s:>7.1f}x")
+        finally:
+            for p in (path, binary_path):
+                if os.path.exists(p):
+                    os.remove(p)
+
+
+if __name__ == "__main__":
+    main()
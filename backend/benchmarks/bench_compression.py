@@ -0,0 +1,66 @@
+"""Measure gzip-compressed upload storage on scaled-up copies of sample.dxf.
+
+Reports the stored size, the time to compress an upload and the analysis time
+of the tag-level reader and of ezdxf on the plain and the compressed file.
+The files are in the page cache, so this shows the decompression overhead;
+on a cold disk the compressed file also needs 5-10x less I/O. The scaled
+samples repeat the same entities, so their compression ratio is much higher
+than that of real drawings. They leave out the DIMENSION records, which the
+tag-level reader hands over to ezdxf.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_compression
+"""
+import os
+import time
+
+from app.dwg_service import read_dxf
+from app.storage import write_upload
+from app.tagreader import fast_analyze
+from benchmarks.common import best_of, scaled_sample
+
+FACTORS = (10, 100, 1000)
+
+
+def comparable(result):
+    """``result`` with its preview geometry as entity dicts"""
+    preview = dict(result["preview"], entities=result["preview"]["entities"].to_dicts())
+    return dict(result, preview=preview)
+
+
+def main():
+    print(f"{'entities':>10} {'plain MB':>9} {'gzip MB':>8} {'ratio':>6} {'gzip s':>7} "
+          f"{'fast s':>7} {'fast gz s':>10} {'ezdxf s':>8} {'ezdxf gz s':>11}")
+    for factor in FACTORS:
+        path = scaled_sample(factor, dimensions=False)
+        stored = os.path.join(os.path.dirname(path), "stored_" + os.path.basename(path))
+        try:
+            with open(path, "rb") as source:
+                started = time.perf_counter()
+                write_upload(source, stored)
+                compress_s = time.perf_counter() - started
+            stored += ".gz"
+
+            result = fast_analyze(stored)
+            assert result is not None, "fast reader fell back on the sample"
+            assert comparable(result) == comparable(fast_analyze(path)), "compressed result differs"
+            entities = result["measurements"]["total_entities"]
+            plain_mb = os.path.getsize(path) / 1024 / 1024
+            gzip_mb = os.path.getsize(stored) / 1024 / 1024
+
+            repeat = 1 if factor >= 1000 else 3
+            fast = best_of(lambda: fast_analyze(path))
+            fast_gz = best_of(lambda: fast_analyze(stored))
+            slow = best_of(lambda: read_dxf(path), repeat)
+            slow_gz = best_of(lambda: read_dxf(stored), repeat)
+            print(f"{entities:>10} {plain_mb:>9.2f} {gzip_mb:>8.2f} {plain_mb / gzip_mb:>5.1f}x "
+                  f"{compress_s:>7.3f} {fast:>7.3f} {fast_gz:>10.3f} {slow:>8.3f} {slow_gz:>11.3f}")
+        finally:
+            for p in (path, stored):
+                if os.path.exists(p):
+                    os.remove(p)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Check that preview requests with a deadline answer close to it.
+
+A scaled copy of sample.dxf is uploaded to a server started with a low
+parallel threshold, so that its analysis runs in chunks and publishes
+partial results. The server is restarted (nothing cached, nothing running)
+and the preview is then polled with ``deadline_ms`` and the continuation
+token until it is complete. Every response, measured up to the last byte
+read, must arrive within ``SLACK_S`` of the deadline, and the partial
+previews must add up to the whole drawing.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_deadline
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+from benchmarks.common import scaled_sample
+
+PORT = 8799
+FACTOR = 6000
+DEADLINE_MS = 500
+# Time allowed past the deadline for the snapshot, serialization and transfer
+SLACK_S = 0.5
+
+
+def start_server(env):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(150):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{PORT}/api/health")
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+
+def request(method, path, body=None, headers=None):
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{PORT}{path}", data=body, headers=headers or {}, method=method
+    )
+    with urllib.request.urlopen(req, timeout=300) as response:
+        return response.read()
+
+
+def upload(path):
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        # A unique trailing comment keeps the upload out of any earlier result
+        content = f.read() + b"999\n%s\n" % boundary.encode()
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"deadline.dxf\"\r\n"
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    response = request("POST", "/api/upload", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    return json.loads(response)["file_id"]
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="bench-deadline-")
+    env = dict(
+        os.environ,
+        METADATA_DB=os.path.join(workdir, "files.db"),
+        ANALYSIS_DISK_CACHE_MB="0",
+        PARALLEL_THRESHOLD_MB="4",
+        PARALLEL_CHUNK_MB="1",
+    )
+    path = scaled_sample(FACTOR, dimensions=False)
+    server = start_server(env)
+    try:
+        file_id = upload(path)
+        server.terminate()
+        server.wait()
+        server = start_server(env)
+
+        print(f"{'seconds':>8} {'entities':>9} {'complete':>9}")
+        latencies, received, token = [], 0, None
+        while True:
+            url = f"/api/files/{file_id}/preview?deadline_ms={DEADLINE_MS}"
+            if token:
+                url += f"&continuation={token}"
+            started = time.perf_counter()
+            body = request("GET", url)
+            latencies.append(time.perf_counter() - started)
+            preview = json.loads(body)
+            received += len(preview["entities"])
+            print(f"{latencies[-1]:>8.2f} {len(preview['entities']):>9} {str(preview['complete']):>9}")
+            if preview["complete"]:
+                break
+            token = preview["continuation"]
+
+        total = len(json.loads(request("GET", f"/api/files/{file_id}/preview"))["entities"])
+        request("DELETE", f"/api/files/{file_id}")
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(path)
+        shutil.rmtree(workdir)
+
+    worst = max(latencies)
+    print(f"{len(latencies)} requests, {received} of {total} entities, worst {worst:.2f} s "
+          f"for a {DEADLINE_MS} ms deadline")
+    assert received == total, "the partial previews don't add up to the drawing"
+    assert worst <= DEADLINE_MS / 1000 + SLACK_S, "a response overshot the deadline"
+
+
+if __name__ == "__main__":
+    main()
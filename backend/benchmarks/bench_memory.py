@@ -0,0 +1,104 @@
+"""Calibrate the peak-memory model used for admission control.
+
+Every drawing of a small corpus (scaled copies of sample.dxf, with and
+without the DIMENSION records the tag-level reader can't handle, and
+synthetic drawings with short and long records) is analyzed in each mode in
+a fresh process. The peak RSS above the process' idle baseline (Linux only, read
+from /proc) is compared with the current estimate, and a least-squares fit
+of ``MEMORY_MODELS`` is printed.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_memory
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+from app.admission import MEMORY_MODELS, estimate_mb, prescan
+from benchmarks.common import scaled_sample, synthetic_drawing
+
+MODES = ("fast", "streaming", "full", "recover")
+
+
+def build_corpus():
+    return (
+        [scaled_sample(factor) for factor in (10, 100, 500, 1000)]
+        + [scaled_sample(factor, dimensions=False) for factor in (1000, 5000, 12000)]
+        + [synthetic_drawing("lines", count) for count in (5000, 50000)]
+        + [synthetic_drawing("polylines", count) for count in (1000, 10000)]
+        + [synthetic_drawing("text", count) for count in (5000, 50000)]
+    )
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def measure(path: str, mode: str) -> float:
+    """Peak RSS in MB above the idle baseline of analyzing ``path`` in ``mode``"""
+    import gc
+    # Import everything up front so module loading isn't measured
+    import ezdxf.addons.iterdxf  # noqa: F401
+    import ezdxf.bbox  # noqa: F401
+    import ezdxf.recover  # noqa: F401
+    import app.streaming  # noqa: F401
+    from app.dwg_service import analyze_file
+
+    gc.collect()
+    # Reset the high-water mark so start-up peaks don't hide the analysis
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = _status_mb("VmRSS:")
+
+    if mode == "fast":
+        result = analyze_file(path)
+    elif mode == "streaming":
+        result = analyze_file(path, 1, 10 ** 9, False)
+    else:
+        result = analyze_file(path, fast_reader=False, loader=mode if mode == "recover" else None)
+    assert result["metadata"]["mode"] == mode, result["metadata"]["mode"]
+    return _status_mb("VmHWM:") - baseline
+
+
+def main():
+    corpus = build_corpus()
+    samples = {mode: [] for mode in MODES}
+    context = multiprocessing.get_context("spawn")
+    try:
+        # A fresh process per measurement so peaks don't carry over
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            print(f"{'file':<28} {'size MB':>8} {'records':>8} {'mode':>10} "
+                  f"{'peak MB':>8} {'estimate':>9}")
+            for path in corpus:
+                profile = prescan(path)
+                for mode in MODES:
+                    if mode == "fast" and not profile.supported:
+                        continue
+                    peak = pool.apply(measure, (path, mode))
+                    samples[mode].append((profile, peak))
+                    print(f"{os.path.basename(path)[:28]:<28} {profile.size / 1024 / 1024:>8.1f} "
+                          f"{profile.records:>8} {mode:>10} {peak:>8.1f} "
+                          f"{estimate_mb(profile, mode):>9.1f}")
+    finally:
+        for path in corpus:
+            os.remove(path)
+
+    print("\nFitted MEMORY_MODELS (base, per_record, per_mb):")
+    for mode, rows in samples.items():
+        records = [p.entities if mode in ("fast", "streaming") else p.records for p, _ in rows]
+        features = np.array([[1.0, r, p.size / 1024 / 1024] for r, (p, _) in zip(records, rows)])
+        peaks = np.array([peak for _, peak in rows])
+        coefficients = np.linalg.lstsq(features, peaks, rcond=None)[0]
+        base, per_record, per_mb = (max(0.0, c) for c in coefficients)
+        print(f'    "{mode}": ({base:.1f}, {per_record:.4f}, {per_mb:.2f}),'
+              f'  # current {MEMORY_MODELS[mode]}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Compare the tag-level reader with ezdxf on scaled-up copies of sample.dxf.
+
+The copies leave out the DIMENSION records, which the tag-level reader
+hands over to ezdxf.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_tagreader
+"""
+import os
+
+import ezdxf
+
+from app.dwg_service import extract_layers, extract_preview_geometry
+from app.tagreader import fast_analyze
+from benchmarks.common import best_of, scaled_sample
+
+FACTORS = (10, 100, 1000)
+
+
+def ezdxf_analyze(path):
+    doc = ezdxf.readfile(path)
+    extract_layers(doc)
+    extract_preview_geometry(doc)
+
+
+def main():
+    print(f"{'entities':>10} {'size MB':>8} {'ezdxf s':>9} {'tagreader s':>12} {'speedup':>8}")
+    for factor in FACTORS:
+        path = scaled_sample(factor, dimensions=False)
+        try:
+            result = fast_analyze(path)
+            assert result is not None, "fast reader fell back on the sample"
+            entities = result["measurements"]["total_entities"]
+            size_mb = os.path.getsize(path) / 1024 / 1024
+
+            slow = best_of(lambda: ezdxf_analyze(path), repeat=1 if factor >= 1000 else 3)
+            fast = best_of(lambda: fast_analyze(path))
+            print(f"{entities:>10} {size_mb:>8.1f} {slow:>9.3f} {fast:>12.3f} {slow / fast:>7.1f}x")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Helpers shared by the benchmark scripts"""
+import os
+import re
+import tempfile
+import time
+
+SAMPLE_DXF = os.path.join(os.path.dirname(__file__), "..", "..", "sample.dxf")
+
+_ENTITIES_RE = re.compile(rb"(\n  2\r?\nENTITIES\r?\n)(.*?)(  0\r?\nENDSEC)", re.S)
+_HANDLE_RE = re.compile(rb"^  5\r?\n[0-9A-Fa-f]+\r?\n", re.M)
+_DIMENSION_RE = re.compile(rb"^  0\r?\nDIMENSION\r?\n.*?(?=^  0\r?\n)", re.M | re.S)
+
+
+def scaled_sample(factor: int, directory: str = None, dimensions: bool = True) -> str:
+    """Write sample.dxf with its ENTITIES section repeated ``factor`` times.
+
+    Handles are stripped from the copies so ezdxf assigns fresh ones. With
+    ``dimensions=False`` the DIMENSION records are left out, which leaves
+    only entity types the tag-level reader handles. Returns the path of the
+    new file.
+    """
+    with open(SAMPLE_DXF, "rb") as f:
+        data = f.read()
+
+    match = _ENTITIES_RE.search(data)
+    entities = _HANDLE_RE.sub(b"", match.group(2))
+    if not dimensions:
+        entities = _DIMENSION_RE.sub(b"", entities)
+    scaled = data[:match.start(2)] + entities * factor + data[match.end(2):]
+
+    fd, path = tempfile.mkstemp(suffix=".dxf", prefix=f"sample_x{factor}_", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(scaled)
+    return path
+
+
+def synthetic_drawing(kind: str, count: int, directory: str = None) -> str:
+    """Write a drawing with ``count`` entities of one kind.
+
+    ``kind`` is ``lines``, ``polylines`` (50 vertices each) or ``text``;
+    together with the scaled samples they cover short and long records.
+    Returns the path of the new file.
+    """
+    import ezdxf
+
+    doc = ezdxf.new("R2010")
+    msp = doc.modelspace()
+    for i in range(count):
+        x, y = (i % 1000) * 10.0, (i // 1000) * 10.0
+        if kind == "lines":
+            msp.add_line((x, y), (x + 5, y + 5))
+        elif kind == "polylines":
+            msp.add_lwpolyline([(x + j * 0.1, y + (j % 2)) for j in range(50)])
+        elif kind == "text":
+            msp.add_text(f"Label {i}", dxfattribs={"insert": (x, y), "height": 2.5})
+        else:
+            raise ValueError(f"Unknown kind: {kind}")
+
+    fd, path = tempfile.mkstemp(suffix=".dxf", prefix=f"{kind}_{count}_", dir=directory)
+    os.close(fd)
+    doc.saveas(path)
+    return path
+
+
+def best_of(func, repeat: int = 3) -> float:
+    """Best wall time of ``repeat`` calls, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
@@ -21,6 +21,17 @@ function App() {
   const fetchFileData = useCallback(async (id: string) => {
     setLoading({ layers: true, measurements: true, preview: true });
 
+    // The quick layer list comes from the layer table alone, so show it
+    // while the full analysis is still running
+    axios.get<LayerResponse>(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/api/files/${id}/layers?quick=true`)
+      .then((quickRes) => {
+        setLayers((current) => (current?.file_id === id ? current : quickRes.data));
+        setLoading((current) => ({ ...current, layers: false }));
+      })
+      .catch(() => {
+        // The full request below reports errors
+      });
+
     try {
       const [layersRes, measurementsRes, previewRes] = await Promise.all([
         axios.get<LayerResponse>(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/api/files/${id}/layers`),
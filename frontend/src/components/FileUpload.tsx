@@ -1,14 +1,118 @@
 import React, { useState, useCallback } from 'react';
 import axios from 'axios';
-import { UploadResponse } from '../types';
+import { UploadResponse, UploadSession } from '../types';
 
 interface FileUploadProps {
   onUploadSuccess: (fileId: string, filename: string) => void;
 }
 
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+// Plain drawings above this size are sent in resumable chunks
+const CHUNKED_UPLOAD_BYTES = 32 * 1024 * 1024;
+const PARALLEL_CHUNKS = 3;
+const CHUNK_ATTEMPTS = 3;
+
+// Hex SHA-256 of a file or chunk, or null where the browser can't hash (plain-HTTP pages)
+const hashBlob = async (blob: Blob): Promise<string | null> => {
+  if (!window.crypto?.subtle) {
+    return null;
+  }
+  const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+};
+
+// Ask the server to add the file from content it already holds; null if it doesn't
+const uploadByHash = async (file: File, sha256: string): Promise<UploadResponse | null> => {
+  try {
+    const response = await axios.post<UploadResponse>(`${API_URL}/api/upload/by-hash`, {
+      filename: file.name,
+      sha256,
+    });
+    return response.data;
+  } catch {
+    // Not stored yet (404) or the check failed: upload the file
+    return null;
+  }
+};
+
+// Upload a file in chunks, a few at a time. The upload id is remembered, so
+// uploading the same file again after a failure only sends the missing chunks.
+const uploadInChunks = async (
+  file: File,
+  sha256: string | null,
+  onProgress: (percent: number) => void
+): Promise<UploadResponse> => {
+  const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+  let session: UploadSession | null = null;
+  const savedId = localStorage.getItem(resumeKey);
+  if (savedId) {
+    try {
+      session = (await axios.get<UploadSession>(`${API_URL}/api/uploads/${savedId}`)).data;
+    } catch {
+      // Expired or committed: start over
+      session = null;
+    }
+  }
+  if (!session) {
+    session = (await axios.post<UploadSession>(`${API_URL}/api/uploads`, {
+      filename: file.name,
+      size: file.size,
+      sha256,
+    })).data;
+    localStorage.setItem(resumeKey, session.upload_id);
+  }
+
+  const { upload_id: uploadId, chunk_size: chunkSize, received } = session;
+  const pending: number[] = [];
+  let sent = 0;
+  for (let offset = 0; offset < file.size; offset += chunkSize) {
+    const end = Math.min(offset + chunkSize, file.size);
+    if (received.some(([start, stop]) => start <= offset && end <= stop)) {
+      sent += end - offset;
+    } else {
+      pending.push(offset);
+    }
+  }
+  onProgress(Math.round((sent / file.size) * 100));
+
+  const sendChunk = async (offset: number) => {
+    const chunk = file.slice(offset, offset + chunkSize);
+    const headers: Record<string, string> = { 'Content-Type': 'application/octet-stream' };
+    const checksum = await hashBlob(chunk);
+    if (checksum) {
+      headers['X-Chunk-SHA256'] = checksum;
+    }
+    for (let attempt = 1; ; attempt++) {
+      try {
+        await axios.put(`${API_URL}/api/uploads/${uploadId}?offset=${offset}`, chunk, { headers });
+        break;
+      } catch (err) {
+        if (attempt >= CHUNK_ATTEMPTS) {
+          throw err;
+        }
+      }
+    }
+    sent += chunk.size;
+    onProgress(Math.round((sent / file.size) * 100));
+  };
+  const sendPending = async () => {
+    for (let offset = pending.shift(); offset !== undefined; offset = pending.shift()) {
+      await sendChunk(offset);
+    }
+  };
+  await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, sendPending));
+
+  const response = await axios.post<UploadResponse>(`${API_URL}/api/uploads/${uploadId}/commit`);
+  localStorage.removeItem(resumeKey);
+  return response.data;
+};
+
 const FileUpload: React.FC<FileUploadProps> = ({ onUploadSuccess }) => {
   const [isDragging, setIsDragging] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
+  const [isChecking, setIsChecking] = useState(false);
+  const [progress, setProgress] = useState<number | null>(null);
   const [error, setError] = useState<string | null>(null);
 
   const handleDragEnter = useCallback((e: React.DragEvent) => {
@@ -49,23 +153,41 @@ const FileUpload: React.FC<FileUploadProps> = ({ onUploadSuccess }) => {
   }, []);
 
   const uploadFile = async (file: File) => {
-    const ext = file.name.split('.').pop()?.toLowerCase();
-    if (ext !== 'dxf' && ext !== 'dwg') {
-      setError('Only .dxf and .dwg files are supported');
+    const name = file.name.toLowerCase();
+    if (!/\.(dxf|dwg)(\.gz)?$|\.zip$/.test(name)) {
+      setError('Only .dxf and .dwg files (optionally as .gz or .zip) are supported');
       return;
     }
 
     setIsUploading(true);
-    const formData = new FormData();
-    formData.append('file', file);
+    setIsChecking(true);
+    setProgress(null);
+    // The server hashes drawings after decompressing them, so only plain ones can match
+    const plain = /\.(dxf|dwg)$/.test(name);
+    const sha256 = plain ? await hashBlob(file).catch(() => null) : null;
+    const stored = sha256 ? await uploadByHash(file, sha256) : null;
+    setIsChecking(false);
+    if (stored?.success) {
+      setIsUploading(false);
+      onUploadSuccess(stored.file_id, stored.filename);
+      return;
+    }
 
     try {
-      const response = await axios.post<UploadResponse>(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/api/upload`, formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-      });
+      let result: UploadResponse;
+      if (plain && file.size > CHUNKED_UPLOAD_BYTES) {
+        result = await uploadInChunks(file, sha256, setProgress);
+      } else {
+        const formData = new FormData();
+        formData.append('file', file);
+        const response = await axios.post<UploadResponse>(`${API_URL}/api/upload`, formData, {
+          headers: { 'Content-Type': 'multipart/form-data' },
+        });
+        result = response.data;
+      }
 
-      if (response.data.success) {
-        onUploadSuccess(response.data.file_id, response.data.filename);
+      if (result.success) {
+        onUploadSuccess(result.file_id, result.filename);
       }
     } catch (err: any) {
       const errorMsg = err.response?.data?.detail || err.message || 'Upload failed';
@@ -73,6 +195,7 @@ const FileUpload: React.FC<FileUploadProps> = ({ onUploadSuccess }) => {
       setError(`Upload failed (${errorStatus}): ${errorMsg}`);
     } finally {
       setIsUploading(false);
+      setProgress(null);
     }
   };
 
@@ -88,19 +211,21 @@ const FileUpload: React.FC<FileUploadProps> = ({ onUploadSuccess }) => {
       >
         <input
           type="file"
-          accept=".dxf,.dwg"
+          accept=".dxf,.dwg,.gz,.zip"
           onChange={handleFileSelect}
           id="file-input"
           disabled={isUploading}
         />
         <label htmlFor="file-input" className="file-label">
           {isUploading ? (
-            <span>Uploading...</span>
+            <span>
+              {isChecking ? 'Checking...' : progress === null ? 'Uploading...' : `Uploading... ${progress}%`}
+            </span>
           ) : (
             <>
               <div className="upload-icon">📁</div>
               <p>Drag & drop a DWG or DXF file here</p>
-              <p className="sub-text">or click to browse</p>
+              <p className="sub-text">or click to browse (.gz and .zip accepted)</p>
             </>
           )}
         </label>
@@ -6,6 +6,9 @@ export interface LayerInfo {
   entity_count: number;
   line_length: number;
   closed_area: number;
+  entity_count_ci?: [number, number] | null;
+  line_length_ci?: [number, number] | null;
+  closed_area_ci?: [number, number] | null;
 }
 
 export interface BoundingBox {
@@ -26,6 +29,9 @@ export interface Measurements {
   total_line_length: number;
   total_closed_area: number;
   dimensions: DimensionData[];
+  total_entities_ci?: [number, number] | null;
+  total_line_length_ci?: [number, number] | null;
+  total_closed_area_ci?: [number, number] | null;
 }
 
 export interface DimensionData {
@@ -59,11 +65,56 @@ export interface GeometryEntity {
   };
 }
 
+export interface AnalysisMetadata {
+  mode: string;
+  duration_ms: number;
+  peak_rss_mb: number;
+  loader?: string | null;
+  fixes?: string[];
+  estimated_mb?: number | null;
+  sample_fraction?: number | null;
+}
+
 export interface PreviewData {
   file_id: string;
   filename: string;
   bounding_box: BoundingBox;
   entities: GeometryEntity[];
+  complete?: boolean;
+  continuation?: string | null;
+  metadata?: AnalysisMetadata | null;
+}
+
+export interface FileInfo {
+  id: string;
+  filename: string;
+  file_size: number;
+  upload_time: string;
+  file_type: string;
+  status: 'queued' | 'processing' | 'ready' | 'failed';
+  error?: string | null;
+  loader?: string | null;
+  fixes?: string[];
+  sha256?: string | null;
+}
+
+export interface FileListResponse {
+  files: FileInfo[];
+  // Pass back as `cursor` for the next page; null on the last page
+  next_cursor: string | null;
+}
+
+// A resumable chunked upload
+export interface UploadSession {
+  upload_id: string;
+  filename: string;
+  size: number;
+  sha256?: string | null;
+  created: string;
+  chunk_size: number;
+  // Byte ranges received so far, as [start, end) pairs
+  received: [number, number][];
+  complete: boolean;
 }
 
 export interface UploadResponse {
@@ -77,10 +128,15 @@ export interface LayerResponse {
   file_id: string;
   filename: string;
   layers: LayerInfo[];
+  complete?: boolean;
+  metadata?: AnalysisMetadata | null;
 }
 
 export interface MeasurementResponse {
   file_id: string;
   filename: string;
   measurements: Measurements;
+  complete?: boolean;
+  continuation?: string | null;
+  metadata?: AnalysisMetadata | null;
 }